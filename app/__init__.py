@@ -6,6 +6,8 @@ from flask_login import LoginManager
 from flask_mail import Mail
 from flask_bootstrap import Bootstrap
 from flask_moment import Moment
+from app.template_cache import init_template_cache
+from app.profiling import init_profiler
 import logging
 from logging.handlers import SMTPHandler, RotatingFileHandler
 import os
@@ -28,6 +30,9 @@ moment = Moment(app)
 
 from app import routes, models, errors
 
+init_template_cache(app)
+init_profiler(app)
+
 '''
 The below block enables an email logger only if the application is not
 running in debug mode and if the email server exists.
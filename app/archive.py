@@ -0,0 +1,34 @@
+from datetime import datetime, timedelta
+from app import app, db
+from app.models import Post, ArchivedPost
+
+# pylint: disable=no-member
+
+
+def archive_posts(before=None, batch_size=1000):
+    '''
+    Moves every post older than the given time (by default POST_ARCHIVE_DAYS
+    ago) from the post table into archived_post. Posts are copied and deleted
+    oldest first, one committed batch at a time, so the job can be stopped
+    and resumed without losing or duplicating posts. Returns the number of
+    posts moved.
+    '''
+    if before is None:
+        before = datetime.utcnow() - timedelta(
+            days=app.config['POST_ARCHIVE_DAYS'])
+    post = Post.__table__
+    moved = 0
+    while True:
+        ids = [post_id for post_id, in db.session.query(Post.id).filter(
+            Post.timestamp < before).order_by(Post.timestamp).limit(
+                batch_size)]
+        if not ids:
+            break
+        db.session.execute(ArchivedPost.__table__.insert().from_select(
+            ['id', 'body', 'timestamp', 'user_id'],
+            db.select([post.c.id, post.c.body, post.c.timestamp,
+                       post.c.user_id]).where(post.c.id.in_(ids))))
+        Post.query.filter(Post.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        moved += len(ids)
+    return moved
@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta
+import click
+from app.archive import archive_posts
+from app.profiling import profile_token
+from app.suggestions import refresh_suggestions
+from app.template_cache import enable_bytecode_cache, preload_templates
+from app.trending import refresh_trending
+
+
+def register(app):
+    @app.cli.group()
+    def suggestions():
+        '''"Who to follow" suggestion commands.'''
+        pass
+
+    @suggestions.command()
+    @click.option('--full', is_flag=True,
+                  help='Recompute every user instead of only stale ones.')
+    def refresh(full):
+        '''Recompute friends-of-friends suggestions.'''
+        count = refresh_suggestions(full=full)
+        click.echo('Refreshed suggestions for {} users.'.format(count))
+
+
+    @app.cli.group()
+    def trending():
+        '''Trending rollup commands.'''
+        pass
+
+    @trending.command('refresh')
+    def refresh_trending_cmd():
+        '''Rebuild the trending summary table.'''
+        count = refresh_trending()
+        click.echo('Stored {} trending entries.'.format(count))
+
+
+    @app.cli.group()
+    def posts():
+        '''Post storage commands.'''
+        pass
+
+    @posts.command()
+    @click.option('--days', type=int, default=None,
+                  help='Archive posts older than this many days.')
+    def archive(days):
+        '''Move old posts into the archive table.'''
+        before = None
+        if days is not None:
+            before = datetime.utcnow() - timedelta(days=days)
+        count = archive_posts(before)
+        click.echo('Archived {} posts.'.format(count))
+
+
+    @app.cli.group()
+    def templates():
+        '''Template compilation commands.'''
+        pass
+
+    @templates.command('compile')
+    @click.option('--cache-dir', default=None,
+                  help='Bytecode cache directory (default TEMPLATE_CACHE_DIR).')
+    def compile_templates(cache_dir):
+        '''Precompile all templates into the bytecode cache.'''
+        cache_dir = cache_dir or app.config['TEMPLATE_CACHE_DIR']
+        if not cache_dir:
+            raise click.UsageError('Set TEMPLATE_CACHE_DIR or pass --cache-dir.')
+        enable_bytecode_cache(app, cache_dir)
+        names = preload_templates(app)
+        click.echo('Compiled {} templates into {}.'.format(len(names),
+                                                           cache_dir))
+
+
+    @app.cli.group()
+    def profile():
+        '''Sampling profiler commands.'''
+        pass
+
+    @profile.command()
+    def token():
+        '''Print a signed X-Profile-Token header value.'''
+        click.echo(profile_token(app))
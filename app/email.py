@@ -19,4 +19,17 @@ def send_password_reset_email(user):
                 text_body=render_template('email/reset_password.txt',
                                           user=user, token=token),
                 html_body=render_template('email/reset_password.html',
-                                          user=user, token=token))
\ No newline at end of file
+                                          user=user, token=token))
+
+def send_export_ready_email(user, download_url):
+    '''
+    Tells the user their data export can be downloaded. Renders email
+    templates
+    '''
+    send_email('[Microblog] Your Data Export Is Ready',
+                sender=app.config['ADMINS'][0],
+                recipients=[user.email],
+                text_body=render_template('email/export_ready.txt',
+                                          user=user, url=download_url),
+                html_body=render_template('email/export_ready.html',
+                                          user=user, url=download_url))
\ No newline at end of file
@@ -0,0 +1,145 @@
+from datetime import datetime
+import gzip
+import json
+import os
+import tempfile
+from threading import Thread
+from time import time
+from app import app, db
+from app.email import send_export_ready_email
+from app.models import User, Post, ArchivedPost, followers
+
+# pylint: disable=no-member
+
+
+def export_path(user):
+    return os.path.join(app.config['EXPORT_DIR'],
+                        'microblog-export-{}.ndjson.gz'.format(user.id))
+
+
+def _timestamp(value):
+    return value.isoformat() + 'Z' if value else None
+
+
+def export_records(user, batch_size=1000):
+    '''
+    Generates the export of a user as a stream of dicts: the profile, then
+    every post (recent and archived) newest first, then the followed and
+    follower lists. Rows are fetched as plain column tuples with
+    yield_per(), so the full history is never loaded at once.
+    '''
+    yield {'type': 'user', 'username': user.username, 'email': user.email,
+           'about_me': user.about_me, 'exported_at': _timestamp(
+               datetime.utcnow())}
+    for model in (Post, ArchivedPost):
+        rows = db.session.query(model.id, model.body, model.timestamp).filter(
+            model.user_id == user.id).order_by(
+                model.timestamp.desc()).yield_per(batch_size)
+        for post_id, body, timestamp in rows:
+            yield {'type': 'post', 'id': post_id, 'body': body,
+                   'timestamp': _timestamp(timestamp)}
+    for kind, ours, theirs in (
+            ('followed', followers.c.follower_id, followers.c.followed_id),
+            ('follower', followers.c.followed_id, followers.c.follower_id)):
+        rows = db.session.query(User.username, followers.c.timestamp).join(
+            followers, (theirs == User.id)).filter(
+                ours == user.id).yield_per(batch_size)
+        for username, timestamp in rows:
+            yield {'type': kind, 'username': username,
+                   'since': _timestamp(timestamp)}
+
+
+def write_export(user, path):
+    '''
+    Writes the user's export to path as gzip-compressed NDJSON, one record
+    per line. The archive is built in a temporary file next to path and
+    renamed into place when complete, so a download never sees a partial
+    file.
+    '''
+    directory = os.path.dirname(path)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as raw, \
+                gzip.GzipFile(fileobj=raw, mode='wb') as archive:
+            for record in export_records(user):
+                archive.write(json.dumps(record).encode('utf-8') + b'\n')
+        os.replace(tmp, path)
+    except Exception:
+        os.remove(tmp)
+        raise
+
+
+def expire_exports():
+    '''
+    Deletes the exports, locks and partial files in EXPORT_DIR that are
+    older than EXPORT_MAX_AGE seconds.
+    '''
+    directory = app.config['EXPORT_DIR']
+    if not os.path.exists(directory):
+        return
+    cutoff = time() - app.config['EXPORT_MAX_AGE']
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def claim_export(user):
+    '''
+    Marks an export as running for the user by creating a lock file next
+    to the export. Returns False, leaving things as they are, if an export
+    is already running or the last one finished less than EXPORT_INTERVAL
+    seconds ago. A lock older than that is left over from a crashed export
+    and is taken over. The lock file works across worker processes. Old
+    exports of every user are expired first.
+    '''
+    expire_exports()
+    path = export_path(user)
+    lock = path + '.lock'
+    interval = app.config['EXPORT_INTERVAL']
+    now = time()
+    if os.path.exists(path) and now - os.path.getmtime(path) < interval:
+        return False
+    if not os.path.exists(app.config['EXPORT_DIR']):
+        os.makedirs(app.config['EXPORT_DIR'])
+    try:
+        os.close(os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        if now - os.path.getmtime(lock) < interval:
+            return False
+        os.utime(lock, None)
+    return True
+
+
+def run_export(app, user_id, download_url):
+    '''
+    Writes the export and emails the user. Runs in a background thread, so
+    failures are logged instead of raised. The lock taken by claim_export()
+    is always released.
+    '''
+    with app.app_context():
+        user = User.query.get(user_id)
+        try:
+            write_export(user, export_path(user))
+            send_export_ready_email(user, download_url)
+        except Exception:
+            app.logger.exception('Export for user %s failed', user_id)
+        finally:
+            os.remove(export_path(user) + '.lock')
+
+
+def start_export(user, download_url):
+    '''
+    Starts the export of the user's data in a background thread, unless
+    claim_export() refuses. The user is emailed download_url once the
+    archive is ready. Returns whether an export was started.
+    '''
+    if not claim_export(user):
+        return False
+    Thread(target=run_export, args=(app, user.id, download_url)).start()
+    return True
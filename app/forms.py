@@ -69,4 +69,7 @@ class ResetPasswordForm(FlaskForm):
     password = PasswordField('Password', validators=[DataRequired()])
     password2 = PasswordField(
         'Repeat Password', validators=[DataRequired(), EqualTo('password')])
-    submit = SubmitField('Request Password Reset')
\ No newline at end of file
+    submit = SubmitField('Request Password Reset')
+
+class ExportForm(FlaskForm):
+    submit = SubmitField('Export your data')
\ No newline at end of file
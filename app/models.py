@@ -1,5 +1,8 @@
 from datetime import datetime
 from app import db, login, app
+from app.tokens import reset_tokens, password_fingerprint
+from flask_sqlalchemy import Pagination
+from sqlalchemy.dialects import postgresql
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
 from hashlib import md5
@@ -11,7 +14,27 @@ import jwt
 
 followers = db.Table('followers',
         db.Column('follower_id', db.Integer, db.ForeignKey('user.id')),
-        db.Column('followed_id', db.Integer, db.ForeignKey('user.id')))
+        db.Column('followed_id', db.Integer, db.ForeignKey('user.id')),
+        db.Column('timestamp', db.DateTime, index=True,
+                  default=datetime.utcnow),
+        db.UniqueConstraint('follower_id', 'followed_id',
+                            name='uq_followers_follower_id_followed_id'))
+
+def insert_ignore(table):
+    '''
+    Returns an INSERT for the given table that skips rows which would break
+    a unique constraint instead of failing, in the dialect of the database
+    in use. Raises NotImplementedError for other databases.
+    '''
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        return postgresql.insert(table).on_conflict_do_nothing()
+    if dialect == 'sqlite':
+        return table.insert().prefix_with('OR IGNORE')
+    if dialect == 'mysql':
+        return table.insert().prefix_with('IGNORE')
+    raise NotImplementedError(
+        'INSERT ignoring duplicates is not supported on ' + dialect)
 
 class User(UserMixin, db.Model):
     '''
@@ -22,8 +45,11 @@ class User(UserMixin, db.Model):
     email = db.Column(db.String(64), index=True, unique=True)
     password_hash = db.Column(db.String(128))
     posts = db.relationship('Post', backref='author', lazy='dynamic')
+    archived_posts = db.relationship('ArchivedPost', backref='author',
+                                     lazy='dynamic')
     about_me = db.Column(db.String(140))
     last_seen = db.Column(db.DateTime, default=datetime.utcnow)
+    suggestions_stale = db.Column(db.Boolean, default=True)
     followed = db.relationship(
         'User', secondary=followers,
         primaryjoin=(followers.c.follower_id == id),
@@ -62,10 +88,77 @@ class User(UserMixin, db.Model):
     def follow(self, user):
         if not self.is_following(user):
             self.followed.append(user)
+            self.suggestions_stale = True
+            Suggestion.query.filter_by(
+                user_id=self.id, suggested_id=user.id).delete()
 
     def unfollow(self, user):
         if self.is_following(user):
             self.followed.remove(user)
+            self.suggestions_stale = True
+
+    def follow_many(self, users):
+        '''
+        Follows all of the given users at once: one query finds the edges
+        that already exist and one bulk INSERT adds the rest. The INSERT
+        ignores duplicates through the unique constraint on the followers
+        table, so a concurrent follow of the same user is not an error.
+        The users reported as newly followed are the ones whose rows were
+        actually inserted. PostgreSQL returns them from the INSERT. Other
+        databases report how many rows were inserted; when that is fewer
+        than were sent, the rows carrying this INSERT's timestamp are read
+        back in the same transaction. Like follow(), the caller commits.
+        Returns the users that were newly followed.
+        '''
+        users = dict((user.id, user) for user in users if user.id != self.id)
+        if not users:
+            return []
+        existing = set(followed_id for followed_id, in db.session.query(
+            followers.c.followed_id).filter(
+                followers.c.follower_id == self.id,
+                followers.c.followed_id.in_(list(users))))
+        stamp = datetime.utcnow()
+        rows = [{'follower_id': self.id, 'followed_id': user_id,
+                 'timestamp': stamp}
+                for user_id in users if user_id not in existing]
+        if not rows:
+            return []
+        insert = insert_ignore(followers)
+        if db.engine.dialect.name == 'postgresql':
+            inserted = set(followed_id for followed_id, in db.session.execute(
+                insert.values(rows).returning(followers.c.followed_id)))
+        elif db.session.execute(insert, rows).rowcount == len(rows):
+            inserted = set(row['followed_id'] for row in rows)
+        else:
+            inserted = set(followed_id for followed_id, in db.session.query(
+                followers.c.followed_id).filter(
+                    followers.c.follower_id == self.id,
+                    followers.c.followed_id.in_(
+                        [row['followed_id'] for row in rows]),
+                    followers.c.timestamp == stamp))
+        new = [user_id for user_id in users if user_id in inserted]
+        if not new:
+            return []
+        self.suggestions_stale = True
+        Suggestion.query.filter(Suggestion.user_id == self.id,
+                                Suggestion.suggested_id.in_(new)).delete(
+                                    synchronize_session=False)
+        return [users[user_id] for user_id in new]
+
+    def unfollow_many(self, users):
+        '''
+        Unfollows all of the given users with a single DELETE. The caller
+        commits. Returns the number of users that were unfollowed.
+        '''
+        ids = [user.id for user in users]
+        if not ids:
+            return 0
+        result = db.session.execute(followers.delete().where(db.and_(
+            followers.c.follower_id == self.id,
+            followers.c.followed_id.in_(ids))))
+        if result.rowcount:
+            self.suggestions_stale = True
+        return result.rowcount
 
     def is_following(self, user):
         return self.followed.filter(
@@ -78,33 +171,72 @@ class User(UserMixin, db.Model):
         own = Post.query.filter_by(user_id=self.id)
         return followed.union(own).order_by(Post.timestamp.desc())
 
+    def paginate_posts(self, page, per_page):
+        '''
+        Paginates the user's own posts, newest first. Pages are served from
+        the post table while it lasts; the page that runs past the user's
+        recent posts is topped up from archived_post and deeper pages are
+        read from the archive alone. Returns a Pagination like paginate().
+        '''
+        page = max(page, 1)
+        start = (page - 1) * per_page
+        recent_total = self.posts.count()
+        items = []
+        if start < recent_total:
+            items = self.posts.order_by(Post.timestamp.desc()).offset(
+                start).limit(per_page).all()
+        if len(items) < per_page:
+            items += self.archived_posts.order_by(
+                ArchivedPost.timestamp.desc()).offset(
+                    max(start - recent_total, 0)).limit(
+                        per_page - len(items)).all()
+        total = recent_total + self.archived_posts.count()
+        return Pagination(None, page, per_page, total, items)
+
+    def suggested_users(self):
+        '''
+        Returns the precomputed "who to follow" list for this user, best
+        match first. The list is built offline by app.suggestions, so this
+        is a single indexed lookup on the suggestion table.
+        '''
+        return User.query.join(
+            Suggestion, (Suggestion.suggested_id == User.id)).filter(
+                Suggestion.user_id == self.id).order_by(Suggestion.rank)
+
     def get_reset_password_token(self, expires_in=600):
         '''
-        Generates a JSON Web Token as a string
+        Generates a JSON Web Token as a string. The token carries a
+        fingerprint of the current password hash, so it is no longer
+        accepted once the password has been changed.
         '''
         return jwt.encode(
-            {'reset_password': self.id, 'exp': time() + expires_in},
+            {'reset_password': self.id, 'exp': time() + expires_in,
+             'fingerprint': password_fingerprint(self.password_hash)},
             app.config['SECRET_KEY'], algorithm='HS256').decode('utf-8')
     
     @staticmethod
     def verify_reset_password_token(token):
         '''
-        Takes a token as its argument and attemps to decode it
-        using the jwt.decode() function. Returns None if token is invalid.
-        If the token is valid, returns the user ID.
+        Takes a token as its argument and checks it with the reset token
+        service, which caches decoded tokens and rejects used ones.
+        Returns None if token is invalid. If the token is valid, returns
+        the user.
         '''
-        try:
-            id = jwt.decode(token, app.config['SECRET_KEY'],
-                            algorithms=['HS256'])['reset_password']
-        except:
+        id = reset_tokens.verify(token)
+        if id is None:
             return
-        return User.query.get(id)
+        user = User.query.get(id)
+        if user is None or reset_tokens.verify(token, user) is None:
+            return
+        return user
 
 class Post(db.Model):
     '''
     Creates a post database. Maps the author of the post to the user
-    with user_id as a foreign key.
+    with user_id as a foreign key. On SQLite the id uses AUTOINCREMENT so
+    that ids freed by archiving are never handed out again.
     '''
+    __table_args__ = {'sqlite_autoincrement': True}
     id = db.Column(db.Integer, primary_key=True)
     body = db.Column(db.String(140))
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
@@ -113,6 +245,55 @@ class Post(db.Model):
     def __repr__(self):
         return '<Post {}>'.format(self.body)
 
+class ArchivedPost(db.Model):
+    '''
+    Posts older than POST_ARCHIVE_DAYS are moved here by app.archive, keeping
+    their original id. Only a (user_id, timestamp) index is kept, which is
+    all profile paging needs, so the hot post table and its timestamp index
+    only hold recent posts.
+    '''
+    __tablename__ = 'archived_post'
+    __table_args__ = (db.Index('ix_archived_post_user_id_timestamp',
+                               'user_id', 'timestamp'),)
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    body = db.Column(db.String(140))
+    timestamp = db.Column(db.DateTime)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+
+    def __repr__(self):
+        return '<ArchivedPost {}>'.format(self.body)
+
+class Suggestion(db.Model):
+    '''
+    Stores the ranked friends-of-friends suggestions for a user. Rows are
+    written in batch by app.suggestions; score is the number of followed
+    users that also follow the suggested user.
+    '''
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'),
+                        primary_key=True)
+    rank = db.Column(db.Integer, primary_key=True)
+    suggested_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    score = db.Column(db.Integer)
+
+    def __repr__(self):
+        return '<Suggestion {} -> {}>'.format(self.user_id, self.suggested_id)
+
+class Trending(db.Model):
+    '''
+    Summary table holding the precomputed trending posts and users for each
+    window configured in TRENDING_WINDOWS. Rows are rebuilt periodically by
+    app.trending, so the trending page never aggregates the post table.
+    '''
+    period = db.Column(db.String(8), primary_key=True)
+    kind = db.Column(db.String(8), primary_key=True)
+    rank = db.Column(db.Integer, primary_key=True)
+    subject_id = db.Column(db.Integer)
+    score = db.Column(db.Integer)
+    computed_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return '<Trending {} {} #{}>'.format(self.period, self.kind, self.rank)
+
 @login.user_loader
 def load_user(id):
     return User.query.get(int(id))
\ No newline at end of file
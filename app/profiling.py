@@ -0,0 +1,183 @@
+import atexit
+from collections import Counter, defaultdict
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from itsdangerous import BadSignature, TimestampSigner
+from werkzeug.exceptions import HTTPException
+
+PROFILE_HEADER = 'X-Profile-Token'
+MAX_DEPTH = 128
+
+
+def init_profiler(app):
+    '''
+    Wraps the WSGI app in a SamplingProfiler when PROFILE_DIR is set.
+    '''
+    if app.config['PROFILE_DIR']:
+        app.wsgi_app = SamplingProfiler(app)
+
+
+def profile_token(app):
+    '''
+    Returns a signed token that turns profiling on for any request sending
+    it in the X-Profile-Token header, until PROFILE_TOKEN_MAX_AGE expires.
+    '''
+    return _signer(app).sign(b'profile').decode('ascii')
+
+
+def _signer(app):
+    return TimestampSigner(app.config['SECRET_KEY'], salt='profile')
+
+
+class SamplingProfiler(object):
+    '''
+    WSGI middleware that samples the Python stacks of the requests it
+    profiles. A request is profiled if it carries a valid profile token or,
+    failing that, with probability PROFILE_SAMPLE_RATE. One background
+    thread reads the stacks of all profiled requests every PROFILE_INTERVAL
+    seconds with sys._current_frames(), so unprofiled requests pay nothing.
+    While no profiled request is running the thread blocks on an event
+    that __call__ sets, instead of waking up to find nothing to sample.
+    The interval is stretched whenever taking a sample costs more than
+    PROFILE_MAX_OVERHEAD of the time between samples.
+
+    Stacks are aggregated per endpoint and written to PROFILE_DIR as
+    <endpoint>.<pid>.folded in the collapsed format read by flamegraph.pl
+    and speedscope.
+    '''
+
+    def __init__(self, app):
+        self.app = app
+        self.wsgi_app = app.wsgi_app
+        self.directory = app.config['PROFILE_DIR']
+        self.rate = app.config['PROFILE_SAMPLE_RATE']
+        self.interval = app.config['PROFILE_INTERVAL']
+        self.max_overhead = app.config['PROFILE_MAX_OVERHEAD']
+        self.flush_interval = app.config['PROFILE_FLUSH_INTERVAL']
+        self.token_max_age = app.config['PROFILE_TOKEN_MAX_AGE']
+        self.signer = _signer(app)
+        self.active = {}
+        self.stacks = defaultdict(Counter)
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        atexit.register(self.flush)
+
+    def __call__(self, environ, start_response):
+        if not self.should_profile(environ):
+            return self.wsgi_app(environ, start_response)
+        ident = threading.get_ident()
+        self.active[ident] = self.endpoint(environ)
+        self.wakeup.set()
+        self.start()
+        try:
+            return self.wsgi_app(environ, start_response)
+        finally:
+            self.active.pop(ident, None)
+
+    def should_profile(self, environ):
+        token = environ.get('HTTP_' + PROFILE_HEADER.upper().replace('-', '_'))
+        if token:
+            try:
+                self.signer.unsign(token, max_age=self.token_max_age)
+                return True
+            except BadSignature:
+                pass
+        return self.rate > 0 and random.random() < self.rate
+
+    def endpoint(self, environ):
+        try:
+            endpoint, _ = self.app.url_map.bind_to_environ(environ).match()
+        except HTTPException:
+            return 'unmatched'
+        return endpoint
+
+    def start(self):
+        if self.thread is None:
+            with self.lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self.run)
+                    self.thread.daemon = True
+                    self.thread.start()
+
+    def run(self):
+        interval = self.interval
+        flushed = time.time()
+        pending = False
+        while True:
+            self.wakeup.clear()
+            if not self.active:
+                # Block until a profiled request starts, waking up only to
+                # write samples that have not been flushed yet.
+                timeout = None
+                if pending:
+                    timeout = max(0, flushed + self.flush_interval -
+                                  time.time())
+                if not self.wakeup.wait(timeout):
+                    self.flush()
+                    flushed, pending = time.time(), False
+                continue
+            time.sleep(interval)
+            if self.active:
+                interval = self.next_interval(self.sample())
+                pending = True
+            if pending and time.time() - flushed > self.flush_interval:
+                self.flush()
+                flushed, pending = time.time(), False
+
+    def next_interval(self, cost):
+        '''
+        Returns the sleep before the next sample, which keeps the time spent
+        sampling at or below max_overhead of the wall clock.
+        '''
+        return max(self.interval, cost / self.max_overhead)
+
+    def sample(self):
+        '''
+        Records the current stack of every profiled request and returns
+        the time it took.
+        '''
+        start = time.perf_counter()
+        frames = sys._current_frames()
+        with self.lock:
+            for ident, endpoint in list(self.active.items()):
+                frame = frames.get(ident)
+                if frame is not None:
+                    self.stacks[endpoint][self.collapse(frame)] += 1
+        return time.perf_counter() - start
+
+    @staticmethod
+    def collapse(frame):
+        names = []
+        while frame is not None and len(names) < MAX_DEPTH:
+            code = frame.f_code
+            names.append('{} ({}:{})'.format(
+                code.co_name, os.path.basename(code.co_filename),
+                code.co_firstlineno).replace(';', ':'))
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def flush(self):
+        '''
+        Writes the stacks collected by this process so far, one file per
+        endpoint. Files are replaced atomically.
+        '''
+        with self.lock:
+            snapshot = dict((endpoint, dict(stacks))
+                            for endpoint, stacks in self.stacks.items())
+        if not snapshot:
+            return
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        for endpoint, stacks in snapshot.items():
+            path = os.path.join(self.directory, '{}.{}.folded'.format(
+                endpoint, os.getpid()))
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.part')
+            with os.fdopen(fd, 'w') as f:
+                for stack, count in sorted(stacks.items()):
+                    f.write('{} {}\n'.format(stack, count))
+            os.replace(tmp, path)
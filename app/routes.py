@@ -1,13 +1,20 @@
-from flask import render_template, flash, redirect, url_for, request
+from flask import render_template, flash, redirect, url_for, request, \
+    send_file, jsonify, abort, make_response
 from flask_login import current_user, login_user, \
     logout_user, login_required
 from app import app, db
 from app.forms import LoginForm, RegistrationForm, \
-    EditProfileForm, PostForm, ResetPasswordRequestForm, ResetPasswordForm
+    EditProfileForm, PostForm, ResetPasswordRequestForm, ResetPasswordForm, \
+    ExportForm
 from app.models import User, Post
 from app.email import send_password_reset_email
+from app.export import export_path, start_export
+from app.tokens import reset_tokens
+from app.trending import trending_posts, trending_users, computed_at
 from werkzeug.urls import url_parse
 from datetime import datetime
+from functools import wraps
+import os
 
 # pylint: disable=no-member
 
@@ -28,6 +35,7 @@ def index():
     '''
     Renders index template. Displays posts from users that the current user
     follows. The list of posts is paginated using the paginate() method.
+    "Who to follow" suggestions are read from the precomputed suggestion table.
     '''
     form = PostForm()
     if form.validate_on_submit():
@@ -43,9 +51,10 @@ def index():
         if posts.has_next else None
     prev_url = url_for('index.html', page=posts.prev_num) \
         if posts.has_prev else None
+    suggestions = current_user.suggested_users().all()
     return render_template('index.html', title='Home', form=form,
                            posts=posts.items, next_url=next_url,
-                           prev_url=prev_url)
+                           prev_url=prev_url, suggestions=suggestions)
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -103,18 +112,21 @@ def register():
 @login_required
 def user(username):
     '''
-    Renders the user template. This is the profile page for the selected user
+    Renders the user template. This is the profile page for the selected user.
+    Paging past the user's recent posts falls through to their archived ones.
     '''
     user = User.query.filter_by(username=username).first_or_404()
     page = request.args.get('page', 1, type=int)
-    posts = user.posts.order_by(Post.timestamp.desc()).paginate(
-        page, app.config['POSTS_PER_PAGE'], False)
+    posts = user.paginate_posts(page, app.config['POSTS_PER_PAGE'])
     next_url = url_for('user', username=user.username, page=posts.next_num) \
         if posts.has_next else None
     prev_url = url_for('user', username=user.username, page=posts.prev_num) \
         if posts.has_prev else None
+    suggestions = user.suggested_users().all() \
+        if user == current_user else None
     return render_template('user.html', user=user, posts=posts.items,
-                           next_url=next_url, prev_url=prev_url)
+                           next_url=next_url, prev_url=prev_url,
+                           suggestions=suggestions, export_form=ExportForm())
 
 @app.route('/edit_profile', methods=['GET', 'POST'])
 @login_required
@@ -168,6 +180,75 @@ def unfollow(username):
     flash(f'You are no longer following {username}.')
     return redirect(url_for('user'))
 
+def resolve_usernames():
+    '''
+    Reads a JSON body of the form {"usernames": [...]} and looks all the
+    usernames up in one query. Only JSON bodies are accepted, which a
+    cross-site HTML form cannot send. Returns (users, not_found, skipped),
+    where skipped holds the current user's own name. Aborts with a JSON
+    400 response if the body is malformed or too long.
+    '''
+    data = request.get_json(silent=True) or {}
+    usernames = data.get('usernames')
+    if not isinstance(usernames, list) or \
+            not all(isinstance(name, str) for name in usernames):
+        abort(make_response(jsonify(
+            {'error': 'Expected {"usernames": [...]}.'}), 400))
+    usernames = list(dict.fromkeys(usernames))
+    if len(usernames) > app.config['FOLLOW_BATCH_LIMIT']:
+        abort(make_response(jsonify({
+            'error': 'At most {} usernames per request.'.format(
+                app.config['FOLLOW_BATCH_LIMIT'])}), 400))
+    users = User.query.filter(User.username.in_(usernames)).all() \
+        if usernames else []
+    found = set(user.username for user in users)
+    not_found = [name for name in usernames if name not in found]
+    skipped = [user.username for user in users if user == current_user]
+    users = [user for user in users if user != current_user]
+    return users, not_found, skipped
+
+def api_login_required(f):
+    '''
+    Like login_required, but answers anonymous callers with a JSON 401
+    response instead of redirecting them to the login page.
+    '''
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not current_user.is_authenticated:
+            return jsonify({'error': 'Authentication required.'}), 401
+        return f(*args, **kwargs)
+    return decorated_function
+
+@app.route('/api/follow', methods=['POST'])
+@api_login_required
+def follow_many():
+    '''
+    Follows a list of users in one transaction. Usernames are resolved in
+    one query and only the missing edges are inserted, so repeating the
+    request is harmless.
+    '''
+    users, not_found, skipped = resolve_usernames()
+    followed = current_user.follow_many(users)
+    db.session.commit()
+    new = set(user.username for user in followed)
+    return jsonify({
+        'followed': [user.username for user in followed],
+        'already_following': [user.username for user in users
+                              if user.username not in new],
+        'not_found': not_found, 'skipped': skipped})
+
+@app.route('/api/unfollow', methods=['POST'])
+@api_login_required
+def unfollow_many():
+    '''
+    Unfollows a list of users with a single DELETE in one transaction.
+    '''
+    users, not_found, skipped = resolve_usernames()
+    count = current_user.unfollow_many(users)
+    db.session.commit()
+    return jsonify({'unfollowed': count, 'not_found': not_found,
+                    'skipped': skipped})
+
 @app.route('/explore')
 @login_required
 def explore():
@@ -186,6 +267,59 @@ def explore():
     return render_template("index.html", title='Explore', posts=posts.items,
                            next_url=next_url, prev_url=prev_url)
 
+@app.route('/trending')
+@login_required
+def trending():
+    '''
+    View function for the trending page. Shows the most active authors and
+    their latest posts for the selected window (1h, 24h or 7d). Everything
+    is read from the precomputed trending table, so the cost of this page
+    does not depend on the size of the post table.
+    '''
+    periods = [period for period, _ in app.config['TRENDING_WINDOWS']]
+    period = request.args.get('window', '24h')
+    if period not in periods:
+        period = '24h'
+    return render_template('trending.html', title='Trending',
+                           periods=periods, period=period,
+                           posts=trending_posts(period).all(),
+                           users=trending_users(period).all(),
+                           updated=computed_at(period))
+
+@app.route('/export', methods=['POST'])
+@login_required
+def export():
+    '''
+    Starts a background export of the current user's posts and follow lists
+    and redirects back to their profile. An email with the download link is
+    sent when the archive is ready. Only one export per user can run at a
+    time, and a new one cannot be started until EXPORT_INTERVAL has passed.
+    '''
+    form = ExportForm()
+    if form.validate_on_submit():
+        if start_export(current_user,
+                        url_for('download_export', _external=True)):
+            flash('Your export has started. '
+                  'We will email you when it is ready.')
+        else:
+            flash('Your export is already running or was made recently.')
+    return redirect(url_for('user', username=current_user.username))
+
+@app.route('/export/download')
+@login_required
+def download_export():
+    '''
+    Serves the current user's latest export. send_file() is conditional, so
+    interrupted downloads can resume with Range requests.
+    '''
+    path = export_path(current_user)
+    if not os.path.exists(path):
+        flash('You have no export ready to download.')
+        return redirect(url_for('user', username=current_user.username))
+    return send_file(path, mimetype='application/gzip', as_attachment=True,
+                     attachment_filename='microblog-export.ndjson.gz',
+                     conditional=True)
+
 @app.route('/reset_password_request', methods=['GET', 'POST'])
 def reset_password_request():
     '''
@@ -209,19 +343,25 @@ def reset_password_request():
 @app.route('/reset_password/<token>', methods=['GET', 'POST'])
 def reset_password(token):
     '''
-    Checks that the user is not logged in. Invokes token verification
-    method from the User class. If token is invalid, redirects to homepage.
-    If token is valid, user is then presented with a second form to 
-    create a new password which then invokes the set_password() method from
-    the User class.
+    Checks that the user is not logged in. Verifies the token with the
+    reset token service. If token is invalid or already used, redirects to
+    homepage. If token is valid, user is then presented with a second form
+    to create a new password which then invokes the set_password() method
+    from the User class. The user is only loaded on submission, where the
+    token must still match their password and is revoked before the
+    password is changed, so a token can only be used once.
     '''
     if current_user.is_authenticated:
         return redirect(url_for('index'))
-    user = User.verify_reset_password_token(token)
-    if not user:
+    user_id = reset_tokens.verify(token)
+    if user_id is None:
         return redirect(url_for('index'))
     form = ResetPasswordForm()
     if form.validate_on_submit():
+        user = User.query.get(user_id)
+        if user is None or reset_tokens.verify(token, user) is None or \
+                not reset_tokens.revoke(token):
+            return redirect(url_for('index'))
         user.set_password(form.password.data)
         db.session.commit()
         flash('Your password has been reset.')
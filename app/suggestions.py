@@ -0,0 +1,208 @@
+from array import array
+from collections import Counter
+from datetime import datetime
+import heapq
+from sqlalchemy import func
+from app import app, db
+from app.models import User, Post, Suggestion, followers
+
+# pylint: disable=no-member
+
+# SQLite refuses statements with more than 999 bound parameters, so id
+# lists are always sent to the database in chunks of this size.
+CHUNK_SIZE = 500
+
+
+def _chunks(ids, size=CHUNK_SIZE):
+    ids = list(ids)
+    for i in range(0, len(ids), size):
+        yield ids[i:i + size]
+
+
+class FollowGraph(object):
+    '''
+    Compact adjacency list of the followers table. The followed ids of every
+    loaded user are stored back to back in a single integer array and the
+    index maps a follower id to its (start, stop) slice of that array, so
+    each edge costs one machine integer instead of a Python object.
+    '''
+
+    def __init__(self):
+        self.index = {}
+        self.targets = array('l')
+
+    def __len__(self):
+        return len(self.targets)
+
+    def load(self, follower_ids=None, batch_size=10000):
+        '''
+        Streams edges from the followers table into the graph. If
+        follower_ids is given only the outgoing edges of those users are
+        loaded, otherwise the whole table is read. Users already in the
+        graph are skipped.
+        '''
+        if follower_ids is None:
+            self._add_edges(self._edges(None).yield_per(batch_size))
+            return self
+        pending = [i for i in set(follower_ids) if i not in self.index]
+        for chunk in _chunks(pending):
+            self._add_edges(self._edges(chunk).yield_per(batch_size))
+        return self
+
+    def followed(self, user_id):
+        start, stop = self.index.get(user_id, (0, 0))
+        return self.targets[start:stop]
+
+    @staticmethod
+    def _edges(follower_ids):
+        query = db.session.query(followers.c.follower_id,
+                                 followers.c.followed_id)
+        if follower_ids is not None:
+            query = query.filter(followers.c.follower_id.in_(follower_ids))
+        return query.order_by(followers.c.follower_id,
+                              followers.c.followed_id)
+
+    def _add_edges(self, edges):
+        current = None
+        start = len(self.targets)
+        for follower_id, followed_id in edges:
+            if follower_id != current:
+                if current is not None:
+                    self.index[current] = (start, len(self.targets))
+                current, start = follower_id, len(self.targets)
+            elif self.targets[-1] == followed_id:
+                continue
+            self.targets.append(followed_id)
+        if current is not None:
+            self.index[current] = (start, len(self.targets))
+
+
+def load_activity(user_ids=None):
+    '''
+    Returns a dict mapping user ids to the most recent sign of activity
+    for that user, which is the later of last_seen and their newest post.
+    '''
+    activity = {}
+
+    def record(user_id, timestamp):
+        if timestamp and timestamp > activity.get(user_id, datetime.min):
+            activity[user_id] = timestamp
+
+    if user_ids is None:
+        chunks = [None]
+    else:
+        chunks = _chunks(user_ids)
+    for chunk in chunks:
+        seen = db.session.query(User.id, User.last_seen)
+        posted = db.session.query(Post.user_id, func.max(Post.timestamp))
+        if chunk is not None:
+            seen = seen.filter(User.id.in_(chunk))
+            posted = posted.filter(Post.user_id.in_(chunk))
+        for user_id, last_seen in seen:
+            record(user_id, last_seen)
+        for user_id, last_post in posted.group_by(Post.user_id):
+            record(user_id, last_post)
+    return activity
+
+
+def rank_suggestions(graph, activity, user_id, limit):
+    '''
+    Ranks the friends-of-friends of user_id. Candidates are scored by the
+    number of followed users that also follow them, and ties are broken in
+    favour of the most recently active candidate. Returns a list of
+    (candidate_id, score) tuples, best first.
+    '''
+    followed = graph.followed(user_id)
+    excluded = set(followed)
+    excluded.add(user_id)
+    mutual = Counter()
+    for followed_id in followed:
+        for candidate_id in graph.followed(followed_id):
+            if candidate_id not in excluded:
+                mutual[candidate_id] += 1
+    return heapq.nlargest(limit, mutual.items(), key=lambda item: (
+        item[1], activity.get(item[0], datetime.min)))
+
+
+def stale_user_ids():
+    '''
+    Returns the ids of users whose suggestions are out of date: users whose
+    own follows changed, plus everyone who follows one of them, since their
+    friends-of-friends went through the changed user.
+    '''
+    stale = set(uid for uid, in db.session.query(User.id).filter_by(
+        suggestions_stale=True))
+    affected = set(stale)
+    for chunk in _chunks(stale):
+        affected.update(uid for uid, in db.session.query(
+            followers.c.follower_id).filter(
+                followers.c.followed_id.in_(chunk)).distinct())
+    return affected
+
+
+def all_user_ids(size=CHUNK_SIZE):
+    '''
+    Generates every user id in ascending chunks, paging on the primary key
+    so that only one chunk of ids is held at a time.
+    '''
+    last = 0
+    while True:
+        chunk = [uid for uid, in db.session.query(User.id).filter(
+            User.id > last).order_by(User.id).limit(size)]
+        if not chunk:
+            return
+        yield chunk
+        last = chunk[-1]
+
+
+def refresh_chunk(user_ids, limit):
+    '''
+    Recomputes and stores the suggestions of one chunk of users. Only the
+    followed lists of the chunk and of the users they follow are loaded,
+    together with the activity of the resulting candidates, so memory is
+    bounded by the two-hop neighbourhood of the chunk rather than by the
+    size of the follower graph.
+    '''
+    graph = FollowGraph().load(user_ids)
+    hop = set()
+    for user_id in user_ids:
+        hop.update(graph.followed(user_id))
+    graph.load(hop)
+    candidates = set()
+    for followed_id in hop:
+        candidates.update(graph.followed(followed_id))
+    activity = load_activity(candidates)
+
+    rows = []
+    for user_id in user_ids:
+        ranked = rank_suggestions(graph, activity, user_id, limit)
+        for rank, (candidate_id, score) in enumerate(ranked):
+            rows.append({'user_id': user_id, 'rank': rank,
+                         'suggested_id': candidate_id, 'score': score})
+    Suggestion.query.filter(Suggestion.user_id.in_(user_ids)).delete(
+        synchronize_session=False)
+    if rows:
+        db.session.execute(Suggestion.__table__.insert(), rows)
+    User.query.filter(User.id.in_(user_ids)).update(
+        {User.suggestions_stale: False}, synchronize_session=False)
+    db.session.commit()
+
+
+def refresh_suggestions(full=False, limit=None):
+    '''
+    Recomputes "who to follow" suggestions and stores them in the
+    suggestion table. By default only stale users are refreshed; with
+    full=True every user is. Either way users are processed and committed
+    one chunk at a time by refresh_chunk(). Returns the number of users
+    refreshed.
+    '''
+    limit = limit or app.config['SUGGESTIONS_PER_USER']
+    if full:
+        chunks = all_user_ids()
+    else:
+        chunks = _chunks(sorted(stale_user_ids()))
+    count = 0
+    for chunk in chunks:
+        refresh_chunk(chunk, limit)
+        count += len(chunk)
+    return count
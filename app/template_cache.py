@@ -0,0 +1,36 @@
+import os
+from jinja2 import FileSystemBytecodeCache
+
+
+def init_template_cache(app):
+    '''
+    Points Jinja at a filesystem bytecode cache when TEMPLATE_CACHE_DIR is
+    set, so templates compiled by one worker (or by the warm-up command) are
+    loaded from disk by the others instead of being compiled again. With
+    TEMPLATE_PRELOAD set every template is also compiled at startup rather
+    than on the first request that uses it.
+    '''
+    if app.config['TEMPLATE_CACHE_DIR']:
+        enable_bytecode_cache(app, app.config['TEMPLATE_CACHE_DIR'])
+    if app.config['TEMPLATE_PRELOAD']:
+        preload_templates(app)
+
+
+def enable_bytecode_cache(app, directory):
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
+
+
+def preload_templates(app):
+    '''
+    Loads every template the app can see, including the Flask-Bootstrap
+    ones, into the Jinja environment (and the bytecode cache, if enabled).
+    Returns the names of the templates loaded.
+    '''
+    env = app.jinja_env
+    names = [name for name in env.list_templates()
+             if name.endswith(('.html', '.txt'))]
+    for name in names:
+        env.get_template(name)
+    return names
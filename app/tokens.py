@@ -0,0 +1,171 @@
+from collections import OrderedDict
+from hashlib import sha256
+import hmac
+import threading
+from time import time
+import jwt
+from app import app
+
+
+class ExpiringCache(object):
+    '''
+    Small least-recently-used map whose entries expire at a given time.
+    Expired entries are dropped when they are looked up, and all of them are
+    purged before the least recently used entry is evicted to make room.
+    All operations hold a lock, so the map can be shared between request
+    threads.
+    '''
+
+    def __init__(self, maxsize, clock=time):
+        self.maxsize = maxsize
+        self.clock = clock
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            return self._get(key, default)
+
+    def set(self, key, value, expires):
+        with self._lock:
+            self._set(key, value, expires)
+
+    def add(self, key, value, expires):
+        '''
+        Sets the key only if it has no live entry. Returns whether it did.
+        '''
+        with self._lock:
+            if self._get(key) is not None:
+                return False
+            self._set(key, value, expires)
+            return True
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def purge(self):
+        with self._lock:
+            self._purge()
+
+    def _get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        expires, value = entry
+        if expires <= self.clock():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def _set(self, key, value, expires):
+        self._data[key] = (expires, value)
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._purge()
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def _purge(self):
+        now = self.clock()
+        for key in [k for k, (expires, _) in self._data.items()
+                    if expires <= now]:
+            del self._data[key]
+
+
+def password_fingerprint(password_hash):
+    '''
+    Returns a keyed digest of a password hash for reset tokens to carry, so
+    a token stops validating once the password it was issued for changes.
+    '''
+    return hmac.new(app.config['SECRET_KEY'].encode('utf-8'),
+                    (password_hash or '').encode('utf-8'),
+                    sha256).hexdigest()[:32]
+
+
+class ResetTokens(object):
+    '''
+    Verifies password reset tokens and makes them single use. Verified
+    tokens are cached for a short time, keyed by a truncated SHA-256 digest
+    of the token, so the GET and POST of a reset are decoded once.
+
+    Tokens carry a fingerprint of the password hash they were issued for,
+    and verify() checks it when given the user, so a token stops working as
+    soon as the password is reset, in every worker. revoke() additionally
+    records used tokens until they expire, atomically, so that of two
+    concurrent submissions of the same token only one gets through.
+    '''
+
+    VERIFIED_TTL = 300
+
+    def __init__(self, maxsize, clock=time):
+        self.verified = ExpiringCache(maxsize, clock)
+        self.revoked = ExpiringCache(maxsize, clock)
+        self.clock = clock
+
+    @staticmethod
+    def _key(token):
+        if not isinstance(token, bytes):
+            token = token.encode('utf-8')
+        return sha256(token).digest()[:16]
+
+    def _claims(self, token):
+        '''
+        Returns the (user id, password fingerprint, expiry) of a token from
+        the cache, decoding
+        and caching it on a miss. Returns None if the token is invalid.
+        '''
+        key = self._key(token)
+        claims = self.verified.get(key)
+        if claims is not None:
+            return claims
+        try:
+            payload = jwt.decode(token, app.config['SECRET_KEY'],
+                                 algorithms=['HS256'])
+        except jwt.InvalidTokenError:
+            return None
+        if 'reset_password' not in payload:
+            return None
+        now = self.clock()
+        expires = payload.get('exp', now + self.VERIFIED_TTL)
+        claims = (payload['reset_password'], payload.get('fingerprint'),
+                  expires)
+        self.verified.set(key, claims, min(expires, now + self.VERIFIED_TTL))
+        return claims
+
+    def verify(self, token, user=None):
+        '''
+        Returns the user id the token was issued for, or None if the token
+        is invalid, expired or has already been used. If user is given the
+        token must also have been issued for that user and their current
+        password.
+        '''
+        if self.revoked.get(self._key(token)):
+            return None
+        claims = self._claims(token)
+        if claims is None:
+            return None
+        if user is not None and (claims[0] != user.id or claims[1] !=
+                                 password_fingerprint(user.password_hash)):
+            return None
+        return claims[0]
+
+    def revoke(self, token):
+        '''
+        Marks the token as used so that later verify() calls reject it.
+        Returns False if the token is invalid or was already revoked, which
+        makes it safe to check and revoke a token in one step.
+        '''
+        claims = self._claims(token)
+        if claims is None:
+            return False
+        key = self._key(token)
+        self.verified.pop(key)
+        return self.revoked.add(key, True, claims[2])
+
+reset_tokens = ResetTokens(app.config['RESET_TOKEN_CACHE_SIZE'])
@@ -0,0 +1,88 @@
+from collections import Counter
+from datetime import datetime
+from sqlalchemy import func
+from app import app, db
+from app.models import User, Post, Trending, followers
+
+# pylint: disable=no-member
+
+# A new follower says more about an author than one more post does.
+FOLLOW_WEIGHT = 2
+
+
+def author_scores(since):
+    '''
+    Scores every author active since the given time: one point per post
+    and FOLLOW_WEIGHT points per new follower. Both queries are range scans
+    over the indexed timestamp columns, so only the window is read.
+    '''
+    scores = Counter()
+    posts = db.session.query(Post.user_id, func.count(Post.id)).filter(
+        Post.timestamp >= since).group_by(Post.user_id)
+    for user_id, count in posts:
+        scores[user_id] += count
+    follows = db.session.query(followers.c.followed_id, func.count()).filter(
+        followers.c.timestamp >= since).group_by(followers.c.followed_id)
+    for user_id, count in follows:
+        scores[user_id] += FOLLOW_WEIGHT * count
+    return scores
+
+
+def refresh_trending(now=None):
+    '''
+    Rebuilds the trending summary table. For each configured window the
+    top authors are ranked by author_scores(), and the trending posts are
+    the newest post in the window from each of those authors, in the same
+    order. The whole table is replaced in a single transaction.
+    '''
+    now = now or datetime.utcnow()
+    size = app.config['TRENDING_SIZE']
+    rows = []
+    for period, span in app.config['TRENDING_WINDOWS']:
+        since = now - span
+        top = author_scores(since).most_common(size)
+        for rank, (user_id, score) in enumerate(top):
+            rows.append({'period': period, 'kind': 'user', 'rank': rank,
+                         'subject_id': user_id, 'score': score,
+                         'computed_at': now})
+        latest = dict(db.session.query(
+            Post.user_id, func.max(Post.timestamp)).filter(
+                Post.timestamp >= since,
+                Post.user_id.in_([user_id for user_id, _ in top])).group_by(
+                    Post.user_id))
+        rank = 0
+        for user_id, score in top:
+            if user_id not in latest:
+                continue
+            post = Post.query.filter_by(
+                user_id=user_id, timestamp=latest[user_id]).first()
+            rows.append({'period': period, 'kind': 'post', 'rank': rank,
+                         'subject_id': post.id, 'score': score,
+                         'computed_at': now})
+            rank += 1
+    Trending.query.delete()
+    if rows:
+        db.session.execute(Trending.__table__.insert(), rows)
+    db.session.commit()
+    return len(rows)
+
+
+def trending_posts(period):
+    return Post.query.join(Trending, (Trending.subject_id == Post.id)).filter(
+        Trending.period == period, Trending.kind == 'post').order_by(
+            Trending.rank)
+
+
+def trending_users(period):
+    return User.query.join(Trending, (Trending.subject_id == User.id)).filter(
+        Trending.period == period, Trending.kind == 'user').order_by(
+            Trending.rank)
+
+
+def computed_at(period):
+    '''
+    Returns when the given window was last rolled up, or None if the
+    rollup has not run yet.
+    '''
+    row = Trending.query.filter_by(period=period).first()
+    return row.computed_at if row else None
@@ -0,0 +1,154 @@
+'''
+Measures template compilation and rendering.
+
+    python benchmarks/bench_templates.py [--processes 7] [--renders 500]
+
+First-request latency is measured in a fresh interpreter per mode: cold
+(templates compiled on first use), bytecode (loaded from a warmed
+TEMPLATE_CACHE_DIR) and preload (compiled at startup, startup cost shown
+separately). Per-page render time compares the _post.html macro imported
+once per render with the previous {% include %} per post.
+'''
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from timeit import default_timer
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+
+PAGES = ['index.html', 'user.html']
+
+# The post loop of index.html before and after the post macro.
+INCLUDE_INDEX = '''{% extends "base.html" %}
+{% block app_content %}
+    {% for post in posts %}
+        {% include '_post_include.html' %}
+    {% endfor %}
+{% endblock %}'''
+MACRO_INDEX = '''{% extends "base.html" %}
+{% from '_post.html' import render_post with context %}
+{% block app_content %}
+    {% for post in posts %}
+        {{ render_post(post) }}
+    {% endfor %}
+{% endblock %}'''
+
+
+def page_context(app, count):
+    from app.models import User, Post
+    user = User(id=1, username='john', email='john@example.com',
+                about_me='hello', last_seen=datetime.utcnow())
+    now = datetime.utcnow()
+    posts = [Post(body='post {}'.format(i), author=user,
+                  timestamp=now - timedelta(minutes=i)) for i in range(count)]
+    return {'title': 'Home', 'user': user, 'posts': posts,
+            'next_url': '/index?page=2', 'prev_url': None}
+
+
+def render(app, template, context):
+    from flask_login import login_user
+    from app.forms import ExportForm
+    with app.test_request_context('/index'):
+        login_user(context['user'])
+        # user.html gets the export form from the user view
+        ctx = dict(context, export_form=ExportForm())
+        app.update_template_context(ctx)
+        return template.render(**ctx)
+
+
+def child(mode):
+    start = default_timer()
+    from app import app
+    from app.template_cache import preload_templates
+    if mode == 'preload':
+        preload_templates(app)
+    startup = default_timer() - start
+    context = page_context(app, 5)
+    first = {}
+    for name in PAGES:
+        start = default_timer()
+        render(app, app.jinja_env.get_template(name), context)
+        first[name] = (default_timer() - start) * 1000
+    print(json.dumps({'startup': startup * 1000, 'first': first}))
+
+
+def first_request(processes):
+    cache_dir = tempfile.mkdtemp()
+    results = {}
+    try:
+        for mode in ['cold', 'warm-cache', 'bytecode', 'preload']:
+            env = dict(os.environ)
+            if mode in ('warm-cache', 'bytecode'):
+                env['TEMPLATE_CACHE_DIR'] = cache_dir
+            if mode == 'warm-cache':
+                env['TEMPLATE_PRELOAD'] = '1'
+            samples = []
+            for _ in range(1 if mode == 'warm-cache' else processes):
+                out = subprocess.check_output(
+                    [sys.executable, __file__, '--child', mode], env=env,
+                    stderr=subprocess.DEVNULL)
+                samples.append(json.loads(out.decode('utf-8')))
+            results[mode] = samples
+    finally:
+        shutil.rmtree(cache_dir)
+    del results['warm-cache']
+    print('first request, median of {} fresh processes (ms)'.format(
+        processes))
+    print('{:>10} {:>10}'.format('mode', 'startup') +
+          ''.join('{:>14}'.format(name) for name in PAGES))
+    for mode, samples in results.items():
+        startup = sorted(s['startup'] for s in samples)[len(samples) // 2]
+        row = '{:>10} {:>10.1f}'.format(mode, startup)
+        for name in PAGES:
+            values = sorted(s['first'][name] for s in samples)
+            row += '{:>14.1f}'.format(values[len(values) // 2])
+        print(row)
+
+
+def per_page(renders, sizes):
+    from jinja2 import ChoiceLoader, DictLoader
+    from app import app
+    with open(os.path.join(ROOT, 'app', 'templates', '_post.html')) as f:
+        body = f.read()
+    body = body.split('\n', 1)[1].rsplit('\n', 1)[0]
+    env = app.jinja_env.overlay(loader=ChoiceLoader([
+        DictLoader({'_post_include.html': body}), app.jinja_env.loader]))
+    include = env.from_string(INCLUDE_INDEX)
+    macro = env.from_string(MACRO_INDEX)
+    print('\nper-page render, mean of {} renders (ms)'.format(renders))
+    print('{:>6} {:>10} {:>10}'.format('posts', 'include', 'macro'))
+    for size in sizes:
+        context = page_context(app, size)
+        times = []
+        for template in (include, macro):
+            render(app, template, context)
+            start = default_timer()
+            for _ in range(renders):
+                render(app, template, context)
+            times.append((default_timer() - start) / renders * 1000)
+        print('{:>6} {:>10.3f} {:>10.3f}'.format(size, *times))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--renders', type=int, default=500)
+    parser.add_argument('--processes', type=int, default=7)
+    parser.add_argument('--posts', type=int, nargs='+', default=[5, 50])
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.child)
+        return
+    first_request(args.processes)
+    per_page(args.renders, args.posts)
+
+
+if __name__ == '__main__':
+    main()
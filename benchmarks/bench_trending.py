@@ -0,0 +1,103 @@
+'''
+Compares reading the trending page from the precomputed summary table with
+aggregating the post table on every request, for growing post tables.
+
+    python benchmarks/bench_trending.py [--reads 200] [--sizes 1000 10000 ...]
+
+Posts are spread evenly over the last 30 days, so the 1h/24h/7d windows
+hold a fixed fraction of the table. Read times should stay flat for the
+summary table while the GROUP BY grows with the table.
+'''
+import argparse
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+from timeit import default_timer
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from sqlalchemy import func
+from app import app, db
+from app.models import User, Post, followers
+from app.trending import refresh_trending, trending_posts, trending_users
+
+# pylint: disable=no-member
+
+USERS = 1000
+
+
+def seed(posts, now):
+    db.drop_all()
+    db.create_all()
+    db.session.execute(User.__table__.insert(), [
+        {'id': i, 'username': 'user{}'.format(i),
+         'email': 'user{}@example.com'.format(i)} for i in range(1, USERS + 1)])
+    rng = random.Random(posts)
+    span = timedelta(days=30).total_seconds()
+    batch = []
+    for i in range(posts):
+        batch.append({'body': 'post {}'.format(i),
+                      'user_id': rng.randint(1, USERS),
+                      'timestamp': now - timedelta(seconds=rng.random() * span)})
+        if len(batch) == 10000:
+            db.session.execute(Post.__table__.insert(), batch)
+            batch = []
+    if batch:
+        db.session.execute(Post.__table__.insert(), batch)
+    edges = set()
+    while len(edges) < min(posts // 10, USERS * (USERS - 1)):
+        edge = (rng.randint(1, USERS), rng.randint(1, USERS))
+        if edge[0] != edge[1]:
+            edges.add(edge)
+    if edges:
+        db.session.execute(followers.insert(), [
+            {'follower_id': a, 'followed_id': b,
+             'timestamp': now - timedelta(seconds=rng.random() * span)}
+            for a, b in sorted(edges)])
+    db.session.commit()
+
+
+def read_summary(period):
+    return trending_posts(period).all(), trending_users(period).all()
+
+
+def read_group_by(period, now):
+    since = now - dict(app.config['TRENDING_WINDOWS'])[period]
+    return db.session.query(Post.user_id, func.count(Post.id)).filter(
+        Post.timestamp >= since).group_by(Post.user_id).order_by(
+            func.count(Post.id).desc()).limit(app.config['TRENDING_SIZE']).all()
+
+
+def timed(fn, reads):
+    start = default_timer()
+    for _ in range(reads):
+        fn()
+    return (default_timer() - start) / reads * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--reads', type=int, default=200)
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 10000, 100000, 300000])
+    parser.add_argument('--window', default='7d')
+    args = parser.parse_args()
+
+    now = datetime.utcnow()
+    print('{:>8} {:>11} {:>14} {:>14}'.format(
+        'posts', 'rollup ms', 'summary ms/rd', 'group by ms/rd'))
+    for size in args.sizes:
+        seed(size, now)
+        start = default_timer()
+        refresh_trending(now=now)
+        rollup = (default_timer() - start) * 1000
+        summary = timed(lambda: read_summary(args.window), args.reads)
+        group_by = timed(lambda: read_group_by(args.window, now), args.reads)
+        print('{:>8} {:>11.1f} {:>14.3f} {:>14.3f}'.format(
+            size, rollup, summary, group_by))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,462 @@
+'''
+Load generator for a running Microblog deployment.
+
+Each virtual user runs scripted sessions against the server: register,
+log in, post, follow a seeded user, then browse explore, profile and index
+pages with a random think time between requests. Throughput, error rate and
+latency percentiles are reported per route for every interval and for the
+whole run.
+
+    # against a server that is already running (seeded with 'seed')
+    python benchmarks/loadtest.py run --url http://127.0.0.1:5000 --users 20
+
+    # seed a database, start a fake SMTP server and the app, then load it
+    python benchmarks/loadtest.py local --users 20 --duration 60
+
+    # add users step by step until the p95 SLO or error budget is broken
+    python benchmarks/loadtest.py local --ramp --users 5 --step 5 --slo 500
+
+'local' accepts any SQLAlchemy --database URL (SQLite by default, or a
+PostgreSQL database) and points the app's MAIL_SERVER at an in-process SMTP
+sink, so password reset and error report mails never leave the machine.
+Seeding refuses a database that already has tables unless --drop is given.
+'''
+import argparse
+import http.cookiejar
+import os
+import random
+import re
+import shlex
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict, namedtuple
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+PASSWORD = 'password'
+CSRF_RE = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+Sample = namedtuple('Sample', 'time route latency ok')
+
+
+class FakeSMTPHandler(socketserver.StreamRequestHandler):
+    '''
+    Speaks just enough SMTP to accept mail from Flask-Mail and the logging
+    SMTPHandler. Messages are counted and discarded.
+    '''
+
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        self.reply('220 localhost fake SMTP')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('ascii', 'replace').strip().upper()
+            if command.startswith('EHLO'):
+                self.reply('250 localhost')
+            elif command == 'DATA':
+                self.reply('354 end data with <CR><LF>.<CR><LF>')
+                while self.rfile.readline().rstrip(b'\r\n') != b'.':
+                    pass
+                self.server.messages += 1
+                self.reply('250 OK')
+            elif command.startswith('QUIT'):
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('250 OK')
+
+
+class FakeSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port=0):
+        socketserver.ThreadingTCPServer.__init__(
+            self, ('127.0.0.1', port), FakeSMTPHandler)
+        self.messages = 0
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self.server_address[1]
+
+
+def seed(database, users, posts, follows, drop=False):
+    '''
+    Creates the schema in the given database and fills it with users named
+    seed0, seed1, ... (all with the same password), their posts and a
+    random follow graph. A database that already has tables is refused
+    unless drop is set, in which case the app's tables are dropped first.
+    '''
+    os.environ['DATABASE_URL'] = database
+    sys.path.insert(0, ROOT)
+    from datetime import datetime, timedelta
+    from sqlalchemy import inspect
+    from werkzeug.security import generate_password_hash
+    from app import db
+    from app.models import User, Post, followers
+
+    if inspect(db.engine).get_table_names():
+        if not drop:
+            sys.exit('{} already has tables; pass --drop to replace them '
+                     'with seed data.'.format(database))
+        db.drop_all()
+    db.create_all()
+    rng = random.Random(0)
+    password_hash = generate_password_hash(PASSWORD)
+    now = datetime.utcnow()
+    db.session.execute(User.__table__.insert(), [
+        {'id': i + 1, 'username': 'seed{}'.format(i),
+         'email': 'seed{}@example.com'.format(i),
+         'password_hash': password_hash} for i in range(users)])
+    db.session.execute(Post.__table__.insert(), [
+        {'user_id': rng.randint(1, users), 'body': 'seeded post {}'.format(i),
+         'timestamp': now - timedelta(minutes=rng.randint(0, 60 * 24 * 30))}
+        for i in range(posts)])
+    edges = set()
+    while len(edges) < min(follows, users * (users - 1)):
+        edge = (rng.randint(1, users), rng.randint(1, users))
+        if edge[0] != edge[1]:
+            edges.add(edge)
+    if edges:
+        db.session.execute(followers.insert(), [
+            {'follower_id': a, 'followed_id': b} for a, b in edges])
+    db.session.commit()
+
+
+class RedirectCounter(urllib.request.HTTPRedirectHandler):
+    '''
+    Follows redirects like the default handler and counts them.
+    '''
+
+    def __init__(self):
+        self.redirects = 0
+
+    def redirect_request(self, *args, **kwargs):
+        self.redirects += 1
+        return urllib.request.HTTPRedirectHandler.redirect_request(
+            self, *args, **kwargs)
+
+
+class Session(object):
+    '''
+    A browser-like client with its own cookie jar. Every request records a
+    Sample under the given route label; redirects are followed and count
+    towards the latency of the request that caused them.
+    '''
+
+    def __init__(self, base_url, samples):
+        self.base_url = base_url.rstrip('/')
+        self.samples = samples
+        self.redirects = RedirectCounter()
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+            self.redirects)
+
+    def request(self, route, path, data=None, redirect=False):
+        '''
+        Requests path and returns (body, final url). The sample is an error
+        for a status of 400 or more, or if redirect is set and the server
+        did not redirect.
+        '''
+        url = self.base_url + path
+        if data is not None:
+            data = urllib.parse.urlencode(data).encode('utf-8')
+        start = time.time()
+        redirects = self.redirects.redirects
+        body, final_url, ok = '', url, False
+        try:
+            with self.opener.open(url, data, timeout=30) as response:
+                body = response.read().decode('utf-8', 'replace')
+                final_url = response.geturl()
+                ok = response.status < 400
+        except (urllib.error.URLError, OSError):
+            pass
+        if redirect and self.redirects.redirects == redirects:
+            ok = False
+        self.samples.append(Sample(start, route, time.time() - start, ok))
+        return body, final_url
+
+    def submit(self, route, path, fields):
+        '''
+        Fetches the form at path and posts fields to it. The app redirects
+        after every accepted form, so a form re-rendered with validation
+        errors counts as an error.
+        '''
+        body, _ = self.request(route + ' (form)', path)
+        match = CSRF_RE.search(body)
+        if match:
+            fields = dict(fields, csrf_token=match.group(1))
+        return self.request(route, path, fields, redirect=True)
+
+
+class VirtualUser(threading.Thread):
+    def __init__(self, number, args, samples, stop):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.number = number
+        self.args = args
+        self.samples = samples
+        self.stop = stop
+        self.rng = random.Random(number)
+        self.sessions = 0
+
+    def think(self):
+        self.stop.wait(self.rng.uniform(0, self.args.think))
+
+    def seeded_user(self):
+        return 'seed{}'.format(self.rng.randrange(self.args.seed_users))
+
+    def run(self):
+        while not self.stop.is_set():
+            self.run_session()
+            self.sessions += 1
+
+    def run_session(self):
+        session = Session(self.args.url, self.samples)
+        username = 'load{}x{}x{}'.format(os.getpid(), self.number,
+                                         self.sessions)
+        if self.rng.random() < self.args.register_ratio:
+            session.submit('register', '/register', {
+                'username': username, 'email': username + '@example.com',
+                'password': PASSWORD, 'password2': PASSWORD})
+        else:
+            username = self.seeded_user()
+        self.think()
+        _, url = session.submit('login', '/login', {
+            'username': username, 'password': PASSWORD})
+        if urllib.parse.urlparse(url).path == '/login':
+            self.samples.append(Sample(time.time(), 'login failed', 0, False))
+            return
+        self.think()
+        session.submit('post', '/index', {
+            'post': 'load test post from {}'.format(username)})
+        self.think()
+        session.request('follow', '/follow/' + self.seeded_user())
+        for _ in range(self.args.pages):
+            if self.stop.is_set():
+                break
+            self.think()
+            page = self.rng.choice(['explore', 'user', 'index'])
+            if page == 'explore':
+                session.request('explore', '/explore?page={}'.format(
+                    self.rng.randint(1, 3)))
+            elif page == 'user':
+                session.request('user', '/user/' + self.seeded_user())
+            else:
+                session.request('index', '/index')
+        session.request('logout', '/logout')
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = max(0, int(round(pct / 100.0 * len(values))) - 1)
+    return values[index]
+
+
+def summarize(samples, seconds):
+    '''
+    Groups samples by route and returns rows of (route, requests, req/s,
+    error %, p50, p95, p99) with latencies in milliseconds. The last row
+    covers every route.
+    '''
+    by_route = defaultdict(list)
+    for sample in samples:
+        by_route[sample.route].append(sample)
+    by_route['ALL'] = list(samples)
+    rows = []
+    for route in sorted(by_route, key=lambda r: (r == 'ALL', r)):
+        group = by_route[route]
+        latencies = [s.latency * 1000 for s in group]
+        errors = sum(1 for s in group if not s.ok)
+        rows.append((route, len(group), len(group) / max(seconds, 1e-9),
+                     100.0 * errors / max(len(group), 1),
+                     percentile(latencies, 50), percentile(latencies, 95),
+                     percentile(latencies, 99)))
+    return rows
+
+
+def print_rows(title, rows):
+    print(title)
+    print('  {:<16} {:>7} {:>8} {:>7} {:>8} {:>8} {:>8}'.format(
+        'route', 'reqs', 'req/s', 'err %', 'p50 ms', 'p95 ms', 'p99 ms'))
+    for row in rows:
+        print('  {:<16} {:>7} {:>8.1f} {:>7.1f} {:>8.1f} {:>8.1f} '
+              '{:>8.1f}'.format(*row))
+    sys.stdout.flush()
+
+
+def run_load(args):
+    '''
+    Runs the load test. With --ramp, --step more users are added every
+    --interval seconds until the overall p95 exceeds --slo milliseconds or
+    the error rate exceeds --max-errors percent, and the last concurrency
+    that met both is reported as the saturation point.
+    '''
+    samples = []
+    stop = threading.Event()
+    users = []
+
+    def add_users(count):
+        for _ in range(count):
+            user = VirtualUser(len(users), args, samples, stop)
+            users.append(user)
+            user.start()
+
+    add_users(args.users)
+    start = time.time()
+    seen = 0
+    last_good = None
+    try:
+        while time.time() - start < args.duration:
+            time.sleep(args.interval)
+            window = samples[seen:]
+            seen += len(window)
+            rows = summarize(window, args.interval)
+            print_rows('t={:.0f}s users={}'.format(
+                time.time() - start, len(users)), rows)
+            if not args.ramp:
+                continue
+            overall = rows[-1]
+            if overall[5] > args.slo or overall[3] > args.max_errors:
+                print('SLO breached at {} users (p95 {:.1f} ms, errors '
+                      '{:.1f}%).'.format(len(users), overall[5], overall[3]))
+                if last_good:
+                    print('Saturation point: {} users at {:.1f} req/s.'.format(
+                        *last_good))
+                else:
+                    print('The SLO was not met at the starting concurrency.')
+                break
+            last_good = (len(users), overall[2])
+            add_users(args.step)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+    elapsed = time.time() - start
+    for user in users:
+        user.join(timeout=35)
+    print_rows('total over {:.0f}s'.format(elapsed),
+               summarize(samples, elapsed))
+
+
+def wait_for_server(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(url + '/login', timeout=2).close()
+            return
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.2)
+    raise RuntimeError('server at {} did not start'.format(url))
+
+
+def run_local(args):
+    '''
+    Seeds a database, starts the fake SMTP server and the application on a
+    local port, runs the load test against it and shuts everything down.
+    '''
+    tmp = tempfile.mkdtemp()
+    database = args.database or 'sqlite:///' + os.path.join(tmp, 'load.db')
+    subprocess.check_call([
+        sys.executable, __file__, 'seed', '--database', database,
+        '--seed-users', str(args.seed_users), '--posts', str(args.posts),
+        '--follows', str(args.follows)] + (['--drop'] if args.drop else []))
+    smtp = FakeSMTPServer()
+    env = dict(os.environ, DATABASE_URL=database, PYTHONPATH=ROOT,
+               FLASK_APP=os.path.join(ROOT, 'microblog.py'),
+               MAIL_SERVER='127.0.0.1', MAIL_PORT=str(smtp.start()))
+    env.pop('FLASK_DEBUG', None)
+    # run from the temporary directory so the app's logs/ end up there
+    command = shlex.split(args.server_cmd.format(port=args.port))
+    server = subprocess.Popen(command, cwd=tmp, env=env,
+                              stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
+    args.url = 'http://127.0.0.1:{}'.format(args.port)
+    try:
+        wait_for_server(args.url)
+        run_load(args)
+    finally:
+        server.terminate()
+        server.wait()
+        smtp.shutdown()
+    print('fake SMTP server received {} messages'.format(smtp.messages))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    seeding = argparse.ArgumentParser(add_help=False)
+    seeding.add_argument('--seed-users', type=int, default=200)
+    seeding.add_argument('--posts', type=int, default=5000)
+    seeding.add_argument('--follows', type=int, default=2000)
+
+    load = argparse.ArgumentParser(add_help=False)
+    load.add_argument('--users', type=int, default=10,
+                      help='concurrent virtual users (initial for --ramp)')
+    load.add_argument('--duration', type=float, default=60)
+    load.add_argument('--interval', type=float, default=10,
+                      help='seconds per report (and per ramp step)')
+    load.add_argument('--think', type=float, default=1.0,
+                      help='maximum think time between requests')
+    load.add_argument('--pages', type=int, default=5,
+                      help='pages browsed per session')
+    load.add_argument('--register-ratio', type=float, default=0.2,
+                      help='share of sessions that register a new user')
+    load.add_argument('--ramp', action='store_true')
+    load.add_argument('--step', type=int, default=5)
+    load.add_argument('--slo', type=float, default=500,
+                      help='p95 latency SLO in milliseconds')
+    load.add_argument('--max-errors', type=float, default=1.0,
+                      help='error rate SLO in percent')
+
+    parser_seed = commands.add_parser('seed', parents=[seeding],
+                                      help='seed a database')
+    parser_seed.add_argument('--database', required=True)
+    parser_seed.add_argument('--drop', action='store_true',
+                             help='replace the tables of a used database')
+
+    parser_run = commands.add_parser('run', parents=[load, seeding],
+                                     help='load a running server')
+    parser_run.add_argument('--url', required=True)
+
+    parser_local = commands.add_parser('local', parents=[load, seeding],
+                                       help='load a local seeded server')
+    parser_local.add_argument('--database',
+                              help='SQLAlchemy URL (default temporary SQLite)')
+    parser_local.add_argument('--drop', action='store_true',
+                              help='replace the tables of a used database')
+    parser_local.add_argument('--port', type=int, default=5055)
+    parser_local.add_argument(
+        '--server-cmd',
+        default=shlex.quote(sys.executable) +
+        ' -m flask run --with-threads --port {port}',
+        help='command that serves the app, {port} is substituted')
+
+    args = parser.parse_args()
+    if args.command == 'seed':
+        seed(args.database, args.seed_users, args.posts, args.follows,
+             args.drop)
+    elif args.command == 'run':
+        run_load(args)
+    else:
+        run_local(args)
+
+
+if __name__ == '__main__':
+    main()
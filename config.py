@@ -1,4 +1,6 @@
 import os
+import tempfile
+from datetime import timedelta
 basedir = os.path.abspath(os.path.dirname(__file__))
 
 class Config(object):
@@ -8,6 +10,30 @@ class Config(object):
         'sqlite:///' + os.path.join(basedir, 'app.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     POSTS_PER_PAGE = 5 # this can be changed at any time
+    SUGGESTIONS_PER_USER = 5 # "who to follow" entries stored per user
+    FOLLOW_BATCH_LIMIT = 100 # usernames accepted per bulk follow request
+    TRENDING_WINDOWS = [('1h', timedelta(hours=1)),
+                        ('24h', timedelta(hours=24)),
+                        ('7d', timedelta(days=7))]
+    TRENDING_SIZE = 10 # posts and users kept per trending window
+    # posts older than this many days are moved to the archive table
+    POST_ARCHIVE_DAYS = int(os.environ.get('POST_ARCHIVE_DAYS') or 365)
+    RESET_TOKEN_CACHE_SIZE = 1024 # verified and used reset tokens kept
+    # compiled template bytecode is shared through this directory if set
+    TEMPLATE_CACHE_DIR = os.environ.get('TEMPLATE_CACHE_DIR')
+    TEMPLATE_PRELOAD = os.environ.get('TEMPLATE_PRELOAD') is not None
+    # sampling profiler, enabled when PROFILE_DIR is set
+    PROFILE_DIR = os.environ.get('PROFILE_DIR')
+    PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE') or 0)
+    PROFILE_INTERVAL = 0.005 # seconds between stack samples
+    PROFILE_MAX_OVERHEAD = 0.02 # share of wall time spent sampling
+    PROFILE_FLUSH_INTERVAL = 60 # seconds between writes to PROFILE_DIR
+    PROFILE_TOKEN_MAX_AGE = 3600 # seconds a profile token stays valid
+    # user exports hold personal data, so they are kept out of the checkout
+    EXPORT_DIR = os.environ.get('EXPORT_DIR') or \
+        os.path.join(tempfile.gettempdir(), 'microblog-exports')
+    EXPORT_INTERVAL = 3600 # seconds before a user can export again
+    EXPORT_MAX_AGE = 7 * 24 * 3600 # seconds before an export is deleted
 
     # SMPT server details for connecting to MIT mail server
     MAIL_SERVER = os.environ.get('MAIL_SERVER')
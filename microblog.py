@@ -1,6 +1,8 @@
-from app import app, db
+from app import app, db, cli
 from app.models import User, Post
 
+cli.register(app)
+
 @app.shell_context_processor
 def make_shell_context():
     '''
@@ -0,0 +1,39 @@
+"""post autoincrement
+
+Revision ID: e2a6f0c94b17
+Revises: c7d83e5a0f19
+Create Date: 2026-10-19 16:05:33.918270
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2a6f0c94b17'
+down_revision = 'c7d83e5a0f19'
+branch_labels = None
+depends_on = None
+
+# pylint: disable=no-member
+def upgrade():
+    # Only SQLite reuses the ids of deleted rows; other databases already
+    # hand out ids from a sequence.
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    with op.batch_alter_table('post', recreate='always',
+                              table_kwargs={'sqlite_autoincrement': True}):
+        pass
+    # start after every id already used, including archived ones
+    op.execute("DELETE FROM sqlite_sequence WHERE name = 'post'")
+    op.execute("INSERT INTO sqlite_sequence (name, seq) SELECT 'post', "
+               "max(coalesce((SELECT max(id) FROM post), 0), "
+               "coalesce((SELECT max(id) FROM archived_post), 0))")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    with op.batch_alter_table('post', recreate='always',
+                              table_kwargs={'sqlite_autoincrement': False}):
+        pass
@@ -1,7 +1,27 @@
 from datetime import datetime, timedelta
+import gzip
+import json
+import os
+import shutil
+import smtplib
+import tempfile
+import threading
+import time
 import unittest
+from unittest import mock
+import jwt
+from sqlalchemy import event
 from app import app, db
-from app.models import User, Post
+from app.models import User, Post, Suggestion, ArchivedPost, \
+    followers, insert_ignore
+from app.archive import archive_posts
+from app.export import export_path, write_export, start_export
+from app.tokens import ExpiringCache, ResetTokens
+from app.template_cache import enable_bytecode_cache, preload_templates
+from app.profiling import SamplingProfiler, profile_token
+from app.suggestions import FollowGraph, refresh_suggestions, \
+    refresh_chunk, all_user_ids
+from app.trending import refresh_trending, trending_posts, trending_users
 
 # pylint: disable=no-member
 
@@ -26,6 +46,9 @@ class UserModelCase(unittest.TestCase):
                                          'd4c74594d841139328695756648b6bd6'
                                          '?d=identicon&s=128'))
 
+    def test_register_page(self):
+        self.assertEqual(app.test_client().get('/register').status_code, 200)
+
     def test_follow(self):
         u1 = User(username='john', email='john@example.com')
         u2 = User(username='susan', email='susan@example.com')
@@ -87,5 +110,662 @@ class UserModelCase(unittest.TestCase):
         self.assertEqual(f3, [p3, p4])
         self.assertEqual(f4, [p4])
 
+    def test_follow_graph(self):
+        u1 = User(username='john', email='john@example.com')
+        u2 = User(username='susan', email='susan@example.com')
+        u3 = User(username='mary', email='mary@example.com')
+        db.session.add_all([u1, u2, u3])
+        db.session.commit()
+        u1.follow(u2)
+        u1.follow(u3)
+        u2.follow(u3)
+        db.session.commit()
+
+        graph = FollowGraph().load()
+        self.assertEqual(len(graph), 3)
+        self.assertEqual(list(graph.followed(u1.id)), [u2.id, u3.id])
+        self.assertEqual(list(graph.followed(u3.id)), [])
+        partial = FollowGraph().load([u2.id])
+        self.assertEqual(list(partial.followed(u2.id)), [u3.id])
+        self.assertEqual(list(partial.followed(u1.id)), [])
+
+
+    def test_follow_many(self):
+        users = [User(username=name, email=name + '@example.com')
+                 for name in ['john', 'susan', 'mary', 'david']]
+        db.session.add_all(users)
+        db.session.commit()
+        u1, u2, u3, u4 = users
+        u1.follow(u2)
+        db.session.commit()
+
+        statements = []
+
+        def count_inserts(conn, cursor, statement, *args):
+            if statement.startswith('INSERT'):
+                statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', count_inserts)
+        try:
+            followed = u1.follow_many([u1, u2, u3, u4, u3])
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count_inserts)
+        db.session.commit()
+        # the new edges are added with a single bulk INSERT
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(followed, [u3, u4])
+        self.assertEqual(u1.followed.count(), 3)
+        self.assertEqual(u3.followers.first(), u1)
+        self.assertEqual(u1.follow_many([u2, u3]), [])
+
+        # the unique constraint makes the bulk insert itself idempotent
+        db.session.execute(insert_ignore(followers),
+                           [{'follower_id': u1.id, 'followed_id': u2.id}])
+        db.session.commit()
+        self.assertEqual(u1.followed.count(), 3)
+
+        self.assertEqual(u1.unfollow_many([u2, u3]), 2)
+        db.session.commit()
+        self.assertEqual(u1.followed.all(), [u4])
+        self.assertEqual(u1.unfollow_many([u2]), 0)
+
+        # an edge added by a concurrent follow after the existing edges
+        # were read is not reported as newly followed
+        def concurrent_follow(table):
+            db.session.execute(followers.insert(),
+                               {'follower_id': u1.id, 'followed_id': u2.id})
+            return insert_ignore(table)
+        with mock.patch('app.models.insert_ignore',
+                        side_effect=concurrent_follow):
+            self.assertEqual(u1.follow_many([u2, u3]), [u3])
+        db.session.commit()
+        self.assertEqual(u1.followed.count(), 3)
+
+    def test_follow_many_view(self):
+        app.config['WTF_CSRF_ENABLED'] = False
+        users = [User(username=name, email=name + '@example.com')
+                 for name in ['john', 'susan', 'mary']]
+        users[0].set_password('cat')
+        db.session.add_all(users)
+        db.session.commit()
+        users[0].follow(users[1])
+        db.session.commit()
+        client = app.test_client()
+        for url in ['/api/follow', '/api/unfollow']:
+            response = client.post(url, data=json.dumps(
+                {'usernames': ['susan']}), content_type='application/json')
+            self.assertEqual(response.status_code, 401)
+            self.assertIn('error', json.loads(response.data.decode('utf-8')))
+        client.post('/login', data={'username': 'john', 'password': 'cat'})
+
+        response = client.post('/api/follow', data=json.dumps(
+            {'usernames': ['susan', 'mary', 'john', 'nobody']}),
+            content_type='application/json')
+        self.assertEqual(json.loads(response.data.decode('utf-8')), {
+            'followed': ['mary'], 'already_following': ['susan'],
+            'not_found': ['nobody'], 'skipped': ['john']})
+        john = User.query.filter_by(username='john').first()
+        self.assertEqual(john.followed.count(), 2)
+
+        response = client.post('/api/unfollow', data=json.dumps(
+            {'usernames': ['susan', 'mary']}),
+            content_type='application/json')
+        self.assertEqual(json.loads(response.data.decode('utf-8'))
+                         ['unfollowed'], 2)
+        response = client.post('/api/follow', data={'usernames': 'mary'})
+        self.assertEqual(response.status_code, 400)
+
+
+class SuggestionCase(unittest.TestCase):
+    def setUp(self):
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.create_all()
+        now = datetime.utcnow()
+        self.users = {}
+        for i, name in enumerate(['john', 'susan', 'mary', 'david', 'anna']):
+            self.users[name] = User(username=name,
+                                    email=name + '@example.com',
+                                    last_seen=now - timedelta(days=i))
+        db.session.add_all(self.users.values())
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def suggested(self, name):
+        return [u.username for u in self.users[name].suggested_users()]
+
+    def test_friends_of_friends(self):
+        u = self.users
+        u['john'].follow(u['susan'])
+        u['john'].follow(u['mary'])
+        u['susan'].follow(u['david'])
+        u['susan'].follow(u['anna'])
+        u['mary'].follow(u['anna'])
+        u['mary'].follow(u['john'])
+        db.session.commit()
+
+        self.assertEqual(refresh_suggestions(full=True), 5)
+        # anna is followed by both susan and mary, david only by susan
+        self.assertEqual(self.suggested('john'), ['anna', 'david'])
+        self.assertEqual(Suggestion.query.filter_by(
+            user_id=u['john'].id).first().score, 2)
+        # mary follows john, who follows susan
+        self.assertEqual(self.suggested('mary'), ['susan'])
+        self.assertEqual(self.suggested('david'), [])
+
+    def test_chunked_full_refresh(self):
+        u = self.users
+        u['john'].follow(u['susan'])
+        u['susan'].follow(u['david'])
+        u['mary'].follow(u['john'])
+        db.session.commit()
+
+        chunks = list(all_user_ids(size=2))
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 1])
+        for chunk in chunks:
+            refresh_chunk(chunk, 5)
+        self.assertEqual(self.suggested('john'), ['david'])
+        self.assertEqual(self.suggested('mary'), ['susan'])
+        self.assertEqual(User.query.filter_by(
+            suggestions_stale=True).count(), 0)
+
+    def test_ties_prefer_recent_activity(self):
+        u = self.users
+        u['john'].follow(u['susan'])
+        u['susan'].follow(u['david'])
+        u['susan'].follow(u['anna'])
+        u['susan'].follow(u['mary'])
+        db.session.add(Post(body='hi', author=u['anna'],
+                            timestamp=datetime.utcnow() + timedelta(hours=1)))
+        db.session.commit()
+
+        refresh_suggestions(full=True)
+        self.assertEqual(self.suggested('john'), ['anna', 'mary', 'david'])
+
+    def test_incremental_refresh(self):
+        u = self.users
+        u['john'].follow(u['susan'])
+        u['susan'].follow(u['mary'])
+        db.session.commit()
+        refresh_suggestions(full=True)
+        self.assertEqual(self.suggested('john'), ['mary'])
+
+        # following a suggested user removes it straight away
+        u['john'].follow(u['mary'])
+        db.session.commit()
+        self.assertEqual(self.suggested('john'), [])
+
+        # susan changed her follows, so john (her follower) is refreshed too
+        u['susan'].follow(u['david'])
+        db.session.commit()
+        self.assertEqual(refresh_suggestions(), 2)
+        self.assertEqual(self.suggested('john'), ['david'])
+        self.assertEqual(refresh_suggestions(), 0)
+
+class ArchiveCase(unittest.TestCase):
+    def setUp(self):
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def test_archive_and_paginate(self):
+        u1 = User(username='john', email='john@example.com')
+        u2 = User(username='susan', email='susan@example.com')
+        db.session.add_all([u1, u2])
+        now = datetime.utcnow()
+        posts = [Post(body='post {}'.format(i), author=u1,
+                      timestamp=now - timedelta(days=i * 100))
+                 for i in range(7)]
+        other = Post(body='old post from susan', author=u2,
+                     timestamp=now - timedelta(days=1000))
+        db.session.add_all(posts + [other])
+        db.session.commit()
+        ids = [p.id for p in posts]
+
+        self.assertEqual(archive_posts(now - timedelta(days=250),
+                                       batch_size=2), 5)
+        self.assertEqual(Post.query.count(), 3)
+        self.assertEqual(ArchivedPost.query.count(), 5)
+        self.assertEqual(u1.archived_posts.first().author, u1)
+        self.assertEqual(archive_posts(now - timedelta(days=250)), 0)
+
+        # three recent posts, then four archived ones, three per page
+        page1 = u1.paginate_posts(1, 3)
+        page2 = u1.paginate_posts(2, 3)
+        page3 = u1.paginate_posts(3, 3)
+        self.assertEqual([p.id for p in page1.items], ids[0:3])
+        self.assertEqual([p.id for p in page2.items], ids[3:6])
+        self.assertEqual([p.id for p in page3.items], ids[6:7])
+        self.assertEqual(page1.total, 7)
+        self.assertTrue(page2.has_next)
+        self.assertFalse(page3.has_next)
+
+        # a page straddling the boundary mixes both tables
+        page = u1.paginate_posts(1, 4)
+        self.assertIsInstance(page.items[2], Post)
+        self.assertIsInstance(page.items[3], ArchivedPost)
+        self.assertEqual([p.id for p in page.items], ids[0:4])
+
+    def test_archive_after_archiving_everything(self):
+        u = User(username='john', email='john@example.com')
+        db.session.add(u)
+        old = datetime.utcnow() - timedelta(days=1000)
+        db.session.add_all([Post(body='post {}'.format(i), author=u,
+                                 timestamp=old) for i in range(3)])
+        db.session.commit()
+        self.assertEqual(archive_posts(), 3)
+        self.assertEqual(Post.query.count(), 0)
+
+        # ids freed by the archive are not handed out again
+        post = Post(body='new post', author=u, timestamp=old)
+        db.session.add(post)
+        db.session.commit()
+        self.assertEqual(post.id, 4)
+        self.assertEqual(archive_posts(), 1)
+        self.assertEqual(ArchivedPost.query.count(), 4)
+
+class ExportCase(unittest.TestCase):
+    def setUp(self):
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        app.config['WTF_CSRF_ENABLED'] = False
+        self.export_dir = tempfile.mkdtemp()
+        app.config['EXPORT_DIR'] = self.export_dir
+        db.create_all()
+        self.u1 = User(username='john', email='john@example.com')
+        self.u2 = User(username='susan', email='susan@example.com')
+        self.u1.set_password('cat')
+        db.session.add_all([self.u1, self.u2])
+        now = datetime.utcnow()
+        db.session.add_all([
+            Post(body='new post', author=self.u1, timestamp=now),
+            Post(body='old post', author=self.u1,
+                 timestamp=now - timedelta(days=1000)),
+            Post(body='post from susan', author=self.u2, timestamp=now)])
+        db.session.commit()
+        self.u1.follow(self.u2)
+        db.session.commit()
+        archive_posts(now - timedelta(days=500))
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        shutil.rmtree(self.export_dir)
+
+    def test_write_export(self):
+        path = export_path(self.u1)
+        write_export(self.u1, path)
+        with gzip.open(path, 'rt') as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(records[0]['type'], 'user')
+        self.assertEqual(records[0]['username'], 'john')
+        self.assertEqual([r['body'] for r in records if r['type'] == 'post'],
+                         ['new post', 'old post'])
+        self.assertEqual([r['username'] for r in records
+                          if r['type'] == 'followed'], ['susan'])
+        self.assertEqual([r for r in records if r['type'] == 'follower'], [])
+        self.assertEqual(os.listdir(self.export_dir), [os.path.basename(path)])
+
+    def test_export_view(self):
+        client = app.test_client()
+        client.post('/login', data={'username': 'john', 'password': 'cat'})
+        self.assertEqual(client.get('/export').status_code, 405)
+        with mock.patch('app.export.Thread') as thread:
+            self.assertEqual(client.post('/export').status_code, 302)
+            client.post('/export')
+        # the second request finds the first export still running
+        self.assertEqual(thread.call_count, 1)
+        with client.session_transaction() as sess:
+            self.assertIn('already running', sess['_flashes'][-1][1])
+
+        # failures in the background job are logged and release the lock
+        run, args = thread.call_args[1]['target'], thread.call_args[1]['args']
+        with mock.patch('app.export.send_export_ready_email',
+                        side_effect=smtplib.SMTPServerDisconnected()):
+            with self.assertLogs(app.logger, 'ERROR') as logs:
+                run(*args)
+        self.assertIn('Export for user', logs.output[0])
+        self.assertEqual(len(os.listdir(self.export_dir)), 1)
+
+        # the finished export is too recent to start another one
+        with mock.patch('app.export.Thread') as thread:
+            client.post('/export')
+        self.assertEqual(thread.call_count, 0)
+
+    def test_expire_exports(self):
+        old, recent = export_path(self.u2), export_path(self.u1)
+        write_export(self.u2, old)
+        write_export(self.u1, recent)
+        created = time.time() - app.config['EXPORT_MAX_AGE'] - 60
+        os.utime(old, (created, created))
+        with mock.patch('app.export.Thread'):
+            self.assertFalse(start_export(self.u1, 'url'))
+        self.assertEqual(os.listdir(self.export_dir),
+                         [os.path.basename(recent)])
+
+    def test_download_range(self):
+        client = app.test_client()
+        client.post('/login', data={'username': 'john', 'password': 'cat'})
+        self.assertEqual(client.get('/export/download').status_code, 302)
+
+        path = export_path(self.u1)
+        write_export(self.u1, path)
+        with open(path, 'rb') as f:
+            data = f.read()
+        response = client.get('/export/download')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, data)
+        response = client.get('/export/download',
+                              headers={'Range': 'bytes=10-19'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, data[10:20])
+
+class Clock(object):
+    def __init__(self):
+        self.now = time.time()
+
+    def __call__(self):
+        return self.now
+
+
+class ResetTokenCase(unittest.TestCase):
+    def setUp(self):
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.create_all()
+        self.clock = Clock()
+        self.tokens = ResetTokens(4, clock=self.clock)
+        self.user = User(username='john', email='john@example.com')
+        db.session.add(self.user)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def test_cache_expiry(self):
+        cache = ExpiringCache(3, clock=self.clock)
+        cache.set('a', 1, self.clock.now + 10)
+        self.assertEqual(cache.get('a'), 1)
+        self.clock.now += 10
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+    def test_cache_eviction(self):
+        cache = ExpiringCache(3, clock=self.clock)
+        for key in 'abc':
+            cache.set(key, key, self.clock.now + 60)
+        cache.get('a')
+        cache.set('d', 'd', self.clock.now + 60)
+        # b was the least recently used entry
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(len(cache), 3)
+
+        # expired entries are purged before live ones are evicted
+        cache.set('e', 'e', self.clock.now + 1)
+        self.clock.now += 5
+        cache.set('f', 'f', self.clock.now + 60)
+        cache.set('g', 'g', self.clock.now + 60)
+        self.assertEqual([cache.get(k) for k in 'adfg'], [None, 'd', 'f', 'g'])
+
+    def test_verify_is_cached(self):
+        token = self.user.get_reset_password_token()
+        with mock.patch('app.tokens.jwt.decode', wraps=jwt.decode) as decode:
+            self.assertEqual(self.tokens.verify(token), self.user.id)
+            self.assertEqual(self.tokens.verify(token), self.user.id)
+        self.assertEqual(decode.call_count, 1)
+
+    def test_invalid_tokens(self):
+        token = self.user.get_reset_password_token(expires_in=-1)
+        self.assertIsNone(self.tokens.verify(token))
+        self.assertIsNone(self.tokens.verify('not a token'))
+        token = jwt.encode({'reset_password': self.user.id}, 'other key',
+                           algorithm='HS256')
+        self.assertIsNone(self.tokens.verify(token))
+
+    def test_single_use(self):
+        token = self.user.get_reset_password_token()
+        other = self.user.get_reset_password_token(expires_in=300)
+        self.assertEqual(self.tokens.verify(token), self.user.id)
+        self.tokens.revoke(token)
+        self.assertIsNone(self.tokens.verify(token))
+        self.assertEqual(self.tokens.verify(other), self.user.id)
+        # the revocation is dropped once the token itself has expired
+        self.assertEqual(len(self.tokens.revoked), 1)
+        self.clock.now += 601
+        self.tokens.revoked.purge()
+        self.assertEqual(len(self.tokens.revoked), 0)
+
+    def test_revoke_is_atomic(self):
+        token = self.user.get_reset_password_token()
+        self.assertEqual(self.tokens.verify(token), self.user.id)
+        self.assertEqual(self.tokens.verify(token), self.user.id)
+        # only the first of two requests that verified the token may use it
+        self.assertTrue(self.tokens.revoke(token))
+        self.assertFalse(self.tokens.revoke(token))
+        self.assertFalse(self.tokens.revoke('not a token'))
+
+    def test_used_token_after_eviction(self):
+        self.user.set_password('cat')
+        db.session.commit()
+        token = self.user.get_reset_password_token()
+        self.assertEqual(self.tokens.verify(token, self.user), self.user.id)
+        self.assertTrue(self.tokens.revoke(token))
+        self.user.set_password('dog')
+        db.session.commit()
+        # other users' resets evict the revocation without blocking anyone
+        for i in range(5):
+            other = self.user.get_reset_password_token(expires_in=300 + i)
+            self.assertEqual(self.tokens.verify(other), self.user.id)
+            self.assertTrue(self.tokens.revoke(other))
+        self.assertEqual(self.tokens.verify(token), self.user.id)
+        # but the token no longer matches the password it was issued for
+        self.assertIsNone(self.tokens.verify(token, self.user))
+        other = User(username='susan', email='susan@example.com')
+        db.session.add(other)
+        db.session.commit()
+        self.assertIsNone(self.tokens.verify(token, other))
+
+    def test_reset_password_view(self):
+        app.config['WTF_CSRF_ENABLED'] = False
+        client = app.test_client()
+        token = self.user.get_reset_password_token()
+        url = '/reset_password/' + token
+        self.assertEqual(client.get(url).status_code, 200)
+        response = client.post(url, data={'password': 'dog',
+                                          'password2': 'dog'})
+        self.assertTrue(response.location.endswith('/login'))
+        self.assertTrue(User.query.get(self.user.id).check_password('dog'))
+        response = client.get(url)
+        self.assertTrue(response.location.endswith('/index'))
+        self.assertIsNone(User.verify_reset_password_token(token))
+
+def wait_in_view(event):
+    event.wait()
+
+
+class TemplateCase(unittest.TestCase):
+    def setUp(self):
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        app.config['WTF_CSRF_ENABLED'] = False
+        db.create_all()
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        app.jinja_env.bytecode_cache = None
+        db.session.remove()
+        db.drop_all()
+        shutil.rmtree(self.cache_dir)
+
+    def test_post_markup(self):
+        u = User(username='john', email='john@example.com')
+        u.set_password('cat')
+        db.session.add(u)
+        db.session.add(Post(body='first post', author=u,
+                            timestamp=datetime.utcnow()))
+        db.session.commit()
+        client = app.test_client()
+        client.post('/login', data={'username': 'john', 'password': 'cat'})
+        for url in ['/index', '/user/john']:
+            data = client.get(url).data.decode('utf-8')
+            self.assertIn('<a href="/user/john">\n               john\n'
+                          '           </a>\n           said <span '
+                          'class="flask-moment"', data)
+            self.assertIn('<br>\n           first post\n', data)
+
+    def test_bytecode_cache(self):
+        enable_bytecode_cache(app, self.cache_dir)
+        app.jinja_env.cache.clear()
+        names = preload_templates(app)
+        self.assertIn('_post.html', names)
+        self.assertIn('bootstrap/base.html', names)
+        cached = os.listdir(self.cache_dir)
+        self.assertEqual(len(cached), len(names))
+        self.assertTrue(all(name.endswith('.cache') for name in cached))
+
+
+class ProfilerCase(unittest.TestCase):
+    def setUp(self):
+        self.profile_dir = tempfile.mkdtemp()
+        app.config['PROFILE_DIR'] = self.profile_dir
+        self.profiler = SamplingProfiler(app)
+
+    def tearDown(self):
+        app.config['PROFILE_DIR'] = None
+        self.profiler.stacks.clear()
+        shutil.rmtree(self.profile_dir)
+
+    def test_should_profile(self):
+        header = 'HTTP_X_PROFILE_TOKEN'
+        self.assertFalse(self.profiler.should_profile({}))
+        self.assertTrue(self.profiler.should_profile(
+            {header: profile_token(app)}))
+        self.assertFalse(self.profiler.should_profile(
+            {header: profile_token(app) + 'x'}))
+        self.profiler.rate = 1
+        self.assertTrue(self.profiler.should_profile({}))
+
+    def test_endpoint(self):
+        environ = {'PATH_INFO': '/explore', 'REQUEST_METHOD': 'GET',
+                   'SERVER_NAME': 'localhost', 'SERVER_PORT': '80',
+                   'wsgi.url_scheme': 'http'}
+        self.assertEqual(self.profiler.endpoint(environ), 'explore')
+        environ['PATH_INFO'] = '/user/john'
+        self.assertEqual(self.profiler.endpoint(environ), 'user')
+        environ['PATH_INFO'] = '/nowhere'
+        self.assertEqual(self.profiler.endpoint(environ), 'unmatched')
+
+    def test_sample_and_flush(self):
+        event = threading.Event()
+        thread = threading.Thread(target=wait_in_view, args=(event,))
+        thread.start()
+        try:
+            self.profiler.active[thread.ident] = 'explore'
+            self.profiler.sample()
+            self.profiler.sample()
+        finally:
+            event.set()
+            thread.join()
+        self.profiler.flush()
+        files = os.listdir(self.profile_dir)
+        self.assertEqual(files, ['explore.{}.folded'.format(os.getpid())])
+        with open(os.path.join(self.profile_dir, files[0])) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(len(lines), 1)
+        stack, count = lines[0].rsplit(' ', 1)
+        self.assertEqual(count, '2')
+        self.assertIn(';wait_in_view (tests.py:', stack)
+
+    def test_idle_thread_blocks(self):
+        self.profiler.rate = 1
+        self.profiler.interval = 0.001
+        self.profiler.flush_interval = 0
+        sample = mock.Mock(wraps=self.profiler.sample)
+        self.profiler.sample = sample
+
+        def wsgi_app(environ, start_response):
+            deadline = time.time() + 5
+            while not sample.called and time.time() < deadline:
+                time.sleep(0.001)
+            return []
+        self.profiler.wsgi_app = wsgi_app
+        environ = {'PATH_INFO': '/explore', 'REQUEST_METHOD': 'GET',
+                   'SERVER_NAME': 'localhost', 'SERVER_PORT': '80',
+                   'wsgi.url_scheme': 'http'}
+        self.profiler(environ, None)
+        self.assertTrue(sample.called)
+
+        # once the request is over the samples are flushed and the thread
+        # waits for the next profiled request without sampling
+        deadline = time.time() + 5
+        while not os.listdir(self.profile_dir) and time.time() < deadline:
+            time.sleep(0.001)
+        self.assertTrue(os.listdir(self.profile_dir))
+        count = sample.call_count
+        time.sleep(0.05)
+        self.assertEqual(sample.call_count, count)
+        self.assertTrue(self.profiler.thread.is_alive())
+        self.assertFalse(self.profiler.wakeup.is_set())
+
+    def test_overhead_cap(self):
+        self.profiler.interval = 0.005
+        self.profiler.max_overhead = 0.02
+        self.assertEqual(self.profiler.next_interval(0.00001), 0.005)
+        self.assertAlmostEqual(self.profiler.next_interval(0.001), 0.05)
+
+class TrendingCase(unittest.TestCase):
+    def setUp(self):
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def test_windows(self):
+        u1 = User(username='john', email='john@example.com')
+        u2 = User(username='susan', email='susan@example.com')
+        u3 = User(username='mary', email='mary@example.com')
+        db.session.add_all([u1, u2, u3])
+        now = datetime.utcnow()
+        p1 = Post(body="old post from john", author=u1,
+                  timestamp=now - timedelta(hours=3))
+        p2 = Post(body="post from john", author=u1,
+                  timestamp=now - timedelta(minutes=10))
+        p3 = Post(body="post from susan", author=u2,
+                  timestamp=now - timedelta(minutes=5))
+        p4 = Post(body="post from mary", author=u3,
+                  timestamp=now - timedelta(days=2))
+        db.session.add_all([p1, p2, p3, p4])
+        db.session.commit()
+        u1.follow(u2)  # susan gains a follower now
+        db.session.commit()
+
+        refresh_trending()
+        # 1h: susan has a post and a follower, john only a post
+        self.assertEqual(trending_users('1h').all(), [u2, u1])
+        self.assertEqual(trending_posts('1h').all(), [p3, p2])
+        # 24h: john's two posts tie with susan, mary is still too old
+        self.assertEqual(set(trending_users('24h')), set([u1, u2]))
+        self.assertEqual(set(trending_posts('24h')), set([p2, p3]))
+        self.assertEqual(trending_users('7d').count(), 3)
+        self.assertEqual(trending_posts('7d').all()[-1], p4)
+
+        # unknown windows fall back to the same default as no window
+        app.config['WTF_CSRF_ENABLED'] = False
+        u1.set_password('cat')
+        db.session.commit()
+        client = app.test_client()
+        client.post('/login', data={'username': 'john', 'password': 'cat'})
+        active = b'class="active">\n            <a href="/trending?window=24h"'
+        self.assertIn(active, client.get('/trending').data)
+        self.assertIn(active, client.get('/trending?window=bogus').data)
+
+        # later rollups replace earlier ones
+        refresh_trending(now=now + timedelta(days=30))
+        self.assertEqual(trending_posts('7d').all(), [])
+
 if __name__ == '__main__':
     unittest.main(verbosity=2)
\ No newline at end of file